@@ -1,22 +1,90 @@
-from typing import Any, Dict, List, Optional
+import asyncio
+import atexit
+import functools
+import logging
+import re
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Generator, List, Optional, Tuple
 
 import anthropic
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Start of each "User: ..." / "Assistant: ..." turn in formatted history
+_TURN_BOUNDARY = re.compile(r"^(?=(?:User|Assistant): )", re.MULTILINE)
+
+# Connection pools shared by every AIGenerator so keep-alive connections
+# (and their TLS sessions) are reused across instances and requests
+_HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+_SHARED_HTTP = anthropic.DefaultHttpxClient(timeout=_HTTP_TIMEOUT, limits=_HTTP_LIMITS)
+atexit.register(_SHARED_HTTP.close)
+
+# Async connections belong to the event loop that opened them, so each running
+# loop gets its own pool; close_async_http() releases it when the loop is done
+_ASYNC_HTTP: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _async_http() -> httpx.AsyncClient:
+    """Return the async connection pool for the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_HTTP.get(loop)
+    if client is None:
+        client = anthropic.DefaultAsyncHttpxClient(
+            timeout=_HTTP_TIMEOUT, limits=_HTTP_LIMITS
+        )
+        _ASYNC_HTTP[loop] = client
+    return client
+
+
+async def close_async_http() -> None:
+    """Close the running event loop's async connection pool, e.g. on app shutdown"""
+    client = _ASYNC_HTTP.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+# Worker threads for running independent tool calls from one response in parallel
+_TOOL_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tool")
 
 
 class AIGenerator:
     """Handles interactions with Anthropic's Claude API for generating responses"""
 
-    # Static system prompt to avoid rebuilding on each call
+    # System prompt template; {tool_rounds} is filled in from max_api_calls
     SYSTEM_PROMPT = """ You are an AI assistant specialized in course materials and educational content with access to tools for course information.
 
 Tool Usage:
 - **Content search tool**: Use for questions about specific course content or detailed educational materials
 - **Course outline tool**: Use for questions about course structure, lessons list, or course overview
-- **Multiple tool calls allowed**: You may call tools sequentially (up to 2 rounds) if needed to fully answer the question
+- **Multiple tool calls allowed**: You may call tools sequentially (up to {tool_rounds} rounds) if needed to fully answer the question
 - **Strategic tool use**: Search content first, then get outline if structure questions remain, or search multiple times with refined queries
 - Synthesize tool results into accurate, fact-based responses
 - If a tool yields no results, state this clearly without offering alternatives
 
+Tool Reference:
+- **search_course_content(query, course_name?, lesson_number?)**
+ - `query` (required): what to look for, phrased as the concept or topic itself (e.g. "tool calling", "vector embeddings"), not the user's full sentence
+ - `course_name` (optional): course title or a distinctive part of it; partial matches work ("MCP", "Computer Use", "Introduction") and are resolved to the closest course title
+ - `lesson_number` (optional): integer lesson number; only set it when the user names a specific lesson
+ - Returns the most relevant excerpts, each headed by `[Course Title - Lesson N]`; use these headers to attribute facts to the right course and lesson
+ - Each excerpt is a passage of lesson text; without `course_name`, excerpts may come from several courses
+ - An unknown course name returns "No course found matching '<name>'"; an empty search returns "No relevant content found", naming any course or lesson filter that was applied
+- **get_course_outline(course_name)**
+ - `course_name` (required): course title or a distinctive part of it; partial matches work
+ - Returns the course title, course link, instructor, lesson count, and every lesson number with its title
+ - Output format: `Course: <title>`, `Course Link: <url>`, `Instructor: <name>`, then `Lessons (<count>):` followed by one `Lesson <number>: <title>` line per lesson
+ - An unknown course name returns "No course found matching '<name>'"
+ - Use it for "what lessons", "how many lessons", "what is lesson N called", "who teaches", or "give me an overview" questions
+- **Choosing parameters**:
+ - Leave optional filters out unless the user clearly asks for a course or lesson; over-filtering hides relevant material
+ - When a question spans several courses, search without `course_name` first
+ - When a first search is too broad, search again with a narrower query or a course/lesson filter instead of repeating the same call
+ - Never invent course titles, lesson numbers, links, or instructors; only report what a tool returned
+
 Response Protocol:
 - **General knowledge questions**: Answer using existing knowledge without searching
 - **Course content questions**: Use the content search tool first, then answer
@@ -26,6 +94,22 @@ Response Protocol:
  - Provide direct answers only — no reasoning process, tool explanations, or question-type analysis
  - Do not mention "based on the search results" or "based on the tool results"
 
+Examples:
+- User: "What is 2 + 2?" → General knowledge; answer directly without tools: "4."
+- User: "What does the MCP course say about servers?" → search_course_content(query="MCP servers", course_name="MCP"); answer with the key points from the excerpts
+- User: "What is covered in lesson 3 of the Chroma course?" → search_course_content(query="lesson overview", course_name="Chroma", lesson_number=3); summarize the lesson content
+- User: "List the lessons of the computer use course." → get_course_outline(course_name="computer use"); return the course title, link, and numbered lesson list exactly as returned
+- User: "Which lesson of the MCP course explains prompts, and what does it say?" → get_course_outline(course_name="MCP") to find the lesson, then search_course_content(query="prompts", course_name="MCP", lesson_number=N) for its content
+- User: "Is there a course about quantum computing?" → search_course_content(query="quantum computing"); if nothing relevant is found, say the course materials do not cover it
+- User: "What is a vector embedding?" → General knowledge; answer directly without tools
+- User: "Who teaches the Chroma course?" → get_course_outline(course_name="Chroma"); report the instructor from the outline
+- User: "How many lessons does the MCP course have?" → get_course_outline(course_name="MCP"); give the lesson count from the outline
+- User: "What does lesson 2 of the computer use course cover?" → search_course_content(query="lesson content", course_name="computer use", lesson_number=2); summarize the lesson content
+- User: "What is lesson 4 of the MCP course called?" → get_course_outline(course_name="MCP"); give the lesson title exactly as returned
+- User: "Which courses mention retrieval-augmented generation?" → search_course_content(query="retrieval-augmented generation"); name the courses the excerpts come from
+- User: "Where can I find the link to the Chroma course?" → get_course_outline(course_name="Chroma"); give the course link exactly as returned
+- User: "How do the MCP and computer use courses each describe tool calling?" → search_course_content(query="tool calling", course_name="MCP"), then search_course_content(query="tool calling", course_name="computer use"); answer for each course
+- User: "What does the Chroma course say about metadata?" → search_course_content(query="metadata", course_name="Chroma"); if the excerpts are too broad, search again with a narrower query such as "metadata filtering"
 
 All responses must be:
 1. **Brief, Concise and focused** - Get to the point quickly
@@ -35,13 +119,59 @@ All responses must be:
 Provide only the direct answer to what was asked.
 """
 
-    def __init__(self, api_key: str, model: str, max_tool_rounds: int = 2):
-        self.client = anthropic.Anthropic(api_key=api_key)
-        self.model = model
-        self.max_tool_rounds = max_tool_rounds
+    # Returned when Claude's response has no text to show
+    FALLBACK_RESPONSE = "I apologize, but I couldn't generate a response."
 
-        # Pre-build base API parameters
-        self.base_params = {"model": self.model, "temperature": 0, "max_tokens": 800}
+    # Marks the end of a stable prompt prefix for Anthropic's prompt cache
+    CACHE_CONTROL = {"type": "ephemeral"}
+
+    # tool_choice for rounds that may call tools, and for the last round,
+    # which must answer
+    TOOL_CHOICE_AUTO = {"type": "auto"}
+    TOOL_CHOICE_NONE = {"type": "none"}
+
+    # Rough characters-per-token ratio used to estimate prompt size locally
+    CHARS_PER_TOKEN = 4
+
+    # Shortest prefix Anthropic will cache; the system prompt must stay above it
+    MIN_CACHEABLE_TOKENS = 1024
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        max_api_calls: int = 3,
+        max_retries: int = 3,
+        max_input_tokens: int = 150_000,
+        max_tokens: int = 800,
+    ):
+        # The SDK retries rate limit, 5xx and connection errors with
+        # exponential backoff and jitter (0.5s initial delay, 8s cap)
+        self.client = anthropic.Anthropic(
+            api_key=api_key, http_client=_SHARED_HTTP, max_retries=max_retries
+        )
+        self.model = model
+        # At least one call is always made, and it must be allowed to answer
+        self.max_api_calls = max(max_api_calls, 1)
+        self.system_prompt = self.SYSTEM_PROMPT.format(
+            tool_rounds=self.max_api_calls - 1
+        )
+        self.max_input_tokens = max_input_tokens
+        self._pool = _TOOL_POOL
+
+        # Generation settings passed directly on every API call
+        self.temperature = 0
+        self.max_tokens = max_tokens
+
+    @property
+    def aclient(self) -> anthropic.AsyncAnthropic:
+        """Async client on the running event loop's shared connection pool"""
+        # Cheap to build; the connection pool is the part worth sharing
+        return anthropic.AsyncAnthropic(
+            api_key=self.client.api_key,
+            http_client=_async_http(),
+            max_retries=self.client.max_retries,
+        )
 
     def generate_response(
         self,
@@ -49,143 +179,609 @@ Provide only the direct answer to what was asked.
         conversation_history: Optional[str] = None,
         tools: Optional[List] = None,
         tool_manager=None,
+        max_tokens: Optional[int] = None,
     ) -> str:
         """
-        Generate AI response with support for up to max_tool_rounds of sequential tool calling.
+        Generate AI response in up to max_api_calls API calls, the last of which
+        must answer without calling tools.
 
         Args:
             query: The user's question or request
             conversation_history: Previous messages for context
             tools: Available tools the AI can use
             tool_manager: Manager to execute tools
+            max_tokens: Output token limit for this call (defaults to self.max_tokens)
 
         Returns:
             Generated response as string
         """
 
-        # Build system content efficiently
-        system_content = (
-            f"{self.SYSTEM_PROMPT}\n\nPrevious conversation:\n{conversation_history}"
-            if conversation_history
-            else self.SYSTEM_PROMPT
+        # Build message chain, cacheable system blocks and tool definitions
+        messages, system_content, tools, max_tokens = self._prepare(
+            query, conversation_history, tools, max_tokens
         )
 
-        # Initialize message chain
-        messages = [{"role": "user", "content": query}]
-
         # If no tools provided, make direct API call
         if not tools or not tool_manager:
-            response = self.client.messages.create(
-                **self.base_params, messages=messages, system=system_content
-            )
-            return self._extract_text_response(response)
+            api_params = self._direct_params(messages, system_content, max_tokens)
+            response = self.client.messages.create(**api_params)
+            self._log_cache_usage(response)
+            return self._answer_text(response, max_tokens)
 
         # Iterative loop for tool calling rounds
-        for round_num in range(self.max_tool_rounds):
-            # Make API call with tools available
-            api_params = {
-                **self.base_params,
-                "messages": messages,
-                "system": system_content,
-                "tools": tools,
-                "tool_choice": {"type": "auto"},
-            }
+        for round_num in range(self.max_api_calls):
+            api_params = self._tool_params(
+                messages, system_content, tools, round_num, max_tokens
+            )
 
             response = self.client.messages.create(**api_params)
+            self._log_cache_usage(response)
 
-            # Termination condition: Claude chose not to use tools
+            # Termination condition: Claude answered instead of using tools
             if response.stop_reason != "tool_use":
-                return self._extract_text_response(response)
+                break
 
             # Claude requested tool use - execute and append results
-            messages.append({"role": "assistant", "content": response.content})
-
-            # Execute tools and add results to messages
             tool_results = self._execute_tools(response.content, tool_manager)
-            if tool_results:
-                messages.append({"role": "user", "content": tool_results})
+            self._append_tool_round(messages, response.content, tool_results)
 
-        # Max rounds reached - make final call without tools to force answer
-        return self._make_final_call(messages, system_content)
+        return self._answer_text(response, max_tokens)
 
-    def _execute_tools(self, content_blocks, tool_manager) -> List[Dict[str, Any]]:
+    async def agenerate_response(
+        self,
+        query: str,
+        conversation_history: Optional[str] = None,
+        tools: Optional[List] = None,
+        tool_manager=None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
         """
-        Execute all tool calls from response content.
+        Async version of generate_response with concurrent tool execution.
 
         Args:
-            content_blocks: Response content containing tool_use blocks
+            query: The user's question or request
+            conversation_history: Previous messages for context
+            tools: Available tools the AI can use
             tool_manager: Manager to execute tools
+            max_tokens: Output token limit for this call (defaults to self.max_tokens)
 
         Returns:
-            List of tool result dictionaries
-        """
-        tool_results = []
-        for content_block in content_blocks:
-            if content_block.type == "tool_use":
-                try:
-                    tool_result = tool_manager.execute_tool(
-                        content_block.name, **content_block.input
-                    )
-
-                    tool_results.append(
-                        {
-                            "type": "tool_result",
-                            "tool_use_id": content_block.id,
-                            "content": tool_result,
-                        }
-                    )
-                except Exception as e:
-                    # Add error as tool result for graceful degradation
-                    tool_results.append(
-                        {
-                            "type": "tool_result",
-                            "tool_use_id": content_block.id,
-                            "content": f"Error executing tool: {str(e)}",
-                            "is_error": True,
-                        }
-                    )
+            Generated response as string
+        """
+        messages, system_content, tools, max_tokens = self._prepare(
+            query, conversation_history, tools, max_tokens
+        )
 
-        return tool_results
+        if not tools or not tool_manager:
+            api_params = self._direct_params(messages, system_content, max_tokens)
+            response = await self.aclient.messages.create(**api_params)
+            self._log_cache_usage(response)
+            return self._answer_text(response, max_tokens)
+
+        for round_num in range(self.max_api_calls):
+            api_params = self._tool_params(
+                messages, system_content, tools, round_num, max_tokens
+            )
 
-    def _extract_text_response(self, response) -> str:
+            response = await self.aclient.messages.create(**api_params)
+            self._log_cache_usage(response)
+
+            if response.stop_reason != "tool_use":
+                break
+
+            tool_results = await self._aexecute_tools(response.content, tool_manager)
+            self._append_tool_round(messages, response.content, tool_results)
+
+        return self._answer_text(response, max_tokens)
+
+    def generate_batch(
+        self,
+        queries: List[str],
+        histories: Optional[List[Optional[str]]] = None,
+        poll_interval: float = 5.0,
+        timeout: float = 24 * 60 * 60,
+    ) -> List[str]:
         """
-        Extract text content from API response.
+        Generate responses for many independent queries with the Message Batches API.
+
+        Batches are billed at half price and processed asynchronously, so this
+        suits offline workloads (evals, bulk summarization). Tools are not
+        available since tool rounds cannot be batched.
 
         Args:
-            response: API response object
+            queries: The questions to answer
+            histories: Optional conversation history for each query
+            poll_interval: Seconds to wait between batch status checks
+            timeout: Seconds to wait for the batch before cancelling it
 
         Returns:
-            Text string from response
+            Generated responses, in the same order as queries
+
+        Raises:
+            ValueError: If histories and queries differ in length
+            TimeoutError: If the batch has not ended within timeout
         """
-        for content_block in response.content:
-            if hasattr(content_block, "type") and content_block.type == "text":
-                return content_block.text
-            elif hasattr(content_block, "text"):
-                # Handle mock objects or direct text attributes
-                return content_block.text
+        if histories is None:
+            histories = [None] * len(queries)
+        elif len(histories) != len(queries):
+            raise ValueError(
+                f"Got {len(histories)} histories for {len(queries)} queries"
+            )
 
-        # Fallback if no text found
-        return "I apologize, but I couldn't generate a response."
+        requests = []
+        for i, (query, history) in enumerate(zip(queries, histories)):
+            messages, system_content, _, max_tokens = self._prepare(
+                query, history, None, None
+            )
+            requests.append(
+                {
+                    "custom_id": f"q{i}",
+                    "params": self._direct_params(messages, system_content, max_tokens),
+                }
+            )
 
-    def _make_final_call(
-        self, messages: List[Dict[str, Any]], system_content: str
-    ) -> str:
+        batch = self.client.messages.batches.create(requests=requests)
+        deadline = time.monotonic() + timeout
+        while batch.processing_status != "ended":
+            if time.monotonic() >= deadline:
+                self.client.messages.batches.cancel(batch.id)
+                raise TimeoutError(
+                    f"Batch {batch.id} did not finish within {timeout} seconds"
+                )
+            time.sleep(poll_interval)
+            batch = self.client.messages.batches.retrieve(batch.id)
+
+        # Results arrive in completion order, so map them back by custom_id
+        responses = [self.FALLBACK_RESPONSE] * len(queries)
+        for entry in self.client.messages.batches.results(batch.id):
+            if entry.result.type == "succeeded":
+                index = int(entry.custom_id[1:])
+                responses[index] = self._extract_text_response(entry.result.message)
+            else:
+                logger.warning(
+                    "Batch request %s %s: %s",
+                    entry.custom_id,
+                    entry.result.type,
+                    getattr(entry.result, "error", None),
+                )
+
+        return responses
+
+    def generate_response_stream(
+        self,
+        query: str,
+        conversation_history: Optional[str] = None,
+        tools: Optional[List] = None,
+        tool_manager=None,
+        max_tokens: Optional[int] = None,
+    ) -> Generator[str, None, str]:
+        """
+        Stream an AI response as text chunks with the same tool calling rounds.
+
+        Each round is streamed and the final message is inspected afterwards
+        for tool_use blocks, so text reaches the caller as soon as it is generated.
+        Any text Claude writes before calling tools is streamed too, separated
+        from the next round's text by a blank line, but it is not part of the
+        returned answer.
+
+        Args:
+            query: The user's question or request
+            conversation_history: Previous messages for context
+            tools: Available tools the AI can use
+            tool_manager: Manager to execute tools
+            max_tokens: Output token limit for this call (defaults to self.max_tokens)
+
+        Yields:
+            Text chunks of the generated response
+
+        Returns:
+            The final answer text, exactly as generate_response would return it
+        """
+        messages, system_content, tools, max_tokens = self._prepare(
+            query, conversation_history, tools, max_tokens
+        )
+
+        if not tools or not tool_manager:
+            api_params = self._direct_params(messages, system_content, max_tokens)
+            response = yield from self._stream_text(api_params)
+            return self._answer_text(response, max_tokens)
+
+        streamed_text = False
+        for round_num in range(self.max_api_calls):
+            api_params = self._tool_params(
+                messages, system_content, tools, round_num, max_tokens
+            )
+
+            separator = "\n\n" if streamed_text else ""
+            response = yield from self._stream_text(api_params, separator)
+
+            if response.stop_reason != "tool_use":
+                break
+
+            streamed_text = streamed_text or any(
+                getattr(block, "type", None) == "text" for block in response.content
+            )
+            tool_results = self._execute_tools(response.content, tool_manager)
+            self._append_tool_round(messages, response.content, tool_results)
+
+        return self._answer_text(response, max_tokens)
+
+    def _prepare(
+        self,
+        query: str,
+        conversation_history: Optional[str],
+        tools: Optional[List],
+        max_tokens: Optional[int],
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Optional[List], int]:
+        """
+        Resolve the inputs shared by every generation path.
+
+        Args:
+            query: The user's question or request
+            conversation_history: Previous messages for context
+            tools: Available tools the AI can use
+            max_tokens: Output token limit, or None for self.max_tokens
+
+        Returns:
+            Tuple of (initial messages, system blocks, tools with a cache
+            breakpoint, output token limit)
+        """
+        if max_tokens is None:
+            max_tokens = self.max_tokens
+
+        conversation_history = self._fit_history(conversation_history, query)
+        system_content = list(
+            self._build_system_blocks(self.system_prompt, conversation_history)
+        )
+        messages = [{"role": "user", "content": query}]
+        return messages, system_content, self._with_cache_breakpoint(tools), max_tokens
+
+    def _direct_params(
+        self,
+        messages: List[Dict[str, Any]],
+        system_content: List[Dict[str, Any]],
+        max_tokens: int,
+    ) -> Dict[str, Any]:
+        """
+        Build API parameters for a call without tools.
+
+        Args:
+            messages: Accumulated message history
+            system_content: System prompt blocks
+            max_tokens: Output token limit for the call
+
+        Returns:
+            Keyword arguments for messages.create
         """
-        Make final API call without tools to force Claude to provide an answer.
+        return {
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": max_tokens,
+            "messages": messages,
+            "system": system_content,
+        }
+
+    def _tool_params(
+        self,
+        messages: List[Dict[str, Any]],
+        system_content: List[Dict[str, Any]],
+        tools: Optional[List],
+        round_num: int,
+        max_tokens: int,
+    ) -> Dict[str, Any]:
+        """
+        Build API parameters for a tool calling round.
+
+        Claude may call tools in every round but the last, where tool_choice is
+        "none" to force an answer. Tools stay defined even then: the API requires
+        them once the messages contain tool_use blocks, and an unchanged tools
+        prefix keeps the last round on the prompt cache.
 
         Args:
             messages: Accumulated message history
-            system_content: System prompt content
+            system_content: System prompt blocks
+            tools: Available tools the AI can use
+            round_num: Zero-based index of the round
+            max_tokens: Output token limit for the call
 
         Returns:
-            Final response text
+            Keyword arguments for messages.create
         """
-        final_params = {
-            **self.base_params,
+        is_last = round_num >= self.max_api_calls - 1
+        # One flat literal per call, not a merge over _direct_params' dict
+        return {
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": max_tokens,
             "messages": messages,
             "system": system_content,
-            # Explicitly no tools parameter
+            "tools": tools,
+            "tool_choice": self.TOOL_CHOICE_NONE if is_last else self.TOOL_CHOICE_AUTO,
+        }
+
+    @staticmethod
+    def _append_tool_round(
+        messages: List[Dict[str, Any]],
+        content_blocks,
+        tool_results: List[Dict[str, Any]],
+    ) -> None:
+        """Append Claude's tool_use turn and the matching tool results to messages"""
+        messages.append({"role": "assistant", "content": content_blocks})
+        if tool_results:
+            messages.append({"role": "user", "content": tool_results})
+
+    def _answer_text(self, response, max_tokens: int) -> str:
+        """Extract the answer text, logging answers cut off at max_tokens"""
+        if response.stop_reason == "max_tokens":
+            logger.warning("Response truncated at max_tokens=%d", max_tokens)
+        return self._extract_text_response(response)
+
+    def _stream_text(
+        self, api_params: Dict[str, Any], separator: str = ""
+    ) -> Generator[str, None, Any]:
+        """
+        Stream text deltas for a single API call.
+
+        Args:
+            api_params: Parameters for client.messages.stream
+            separator: Text to yield before the first chunk, if any text arrives
+
+        Yields:
+            Text chunks as they arrive
+
+        Returns:
+            The complete final message
+        """
+        with self.client.messages.stream(**api_params) as stream:
+            for text in stream.text_stream:
+                if separator:
+                    yield separator
+                    separator = ""
+                yield text
+            response = stream.get_final_message()
+
+        self._log_cache_usage(response)
+        return response
+
+    def _estimate_tokens(self, text: str) -> int:
+        """Estimate the token count of text without an API round-trip"""
+        return len(text) // self.CHARS_PER_TOKEN
+
+    def _fit_history(
+        self, conversation_history: Optional[str], query: str
+    ) -> Optional[str]:
+        """
+        Drop the oldest conversation turns until the prompt fits max_input_tokens.
+
+        Args:
+            conversation_history: Formatted "User: ..."/"Assistant: ..." history
+            query: The user's question or request
+
+        Returns:
+            The most recent turns that fit the budget, or None if none fit
+        """
+        if not conversation_history:
+            return conversation_history
+
+        budget = (
+            self.max_input_tokens
+            - self._estimate_tokens(self.system_prompt)
+            - self._estimate_tokens(query)
+        )
+        if self._estimate_tokens(conversation_history) <= budget:
+            return conversation_history
+
+        kept: List[str] = []
+        for turn in reversed(_TURN_BOUNDARY.split(conversation_history)):
+            budget -= self._estimate_tokens(turn)
+            if budget < 0:
+                break
+            kept.append(turn)
+
+        trimmed = "".join(reversed(kept)).rstrip()
+        return trimmed or None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=128)
+    def _build_system_blocks(
+        system_prompt: str,
+        conversation_history: Optional[str],
+    ) -> Tuple[Dict[str, Any], ...]:
+        """
+        Build system prompt blocks with a cache breakpoint after the static prompt.
+
+        Conversation history changes every turn, so it is placed after the
+        breakpoint to keep the static prefix cacheable. Results are memoised
+        per history, so repeated calls reuse the same block objects.
+
+        Args:
+            system_prompt: The generator's rendered system prompt
+            conversation_history: Previous messages for context
+
+        Returns:
+            Tuple of system content blocks
+        """
+        blocks: Tuple[Dict[str, Any], ...] = (
+            {
+                "type": "text",
+                "text": system_prompt,
+                "cache_control": AIGenerator.CACHE_CONTROL,
+            },
+        )
+        if conversation_history:
+            blocks += (
+                {
+                    "type": "text",
+                    "text": f"Previous conversation:\n{conversation_history}",
+                },
+            )
+        return blocks
+
+    def _with_cache_breakpoint(self, tools: Optional[List]) -> Optional[List]:
+        """
+        Return a copy of the tool definitions with a cache breakpoint on the last one.
+
+        Args:
+            tools: Tool definitions to send to the API
+
+        Returns:
+            Tool definitions with caching enabled, or the input if empty
+        """
+        if not tools:
+            return tools
+        return [*tools[:-1], {**tools[-1], "cache_control": self.CACHE_CONTROL}]
+
+    def _log_cache_usage(self, response) -> None:
+        """Log prompt cache statistics reported by the API"""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        logger.debug(
+            "Prompt cache: created=%s read=%s",
+            getattr(usage, "cache_creation_input_tokens", None),
+            getattr(usage, "cache_read_input_tokens", None),
+        )
+
+    def _execute_tools(self, content_blocks, tool_manager) -> List[Dict[str, Any]]:
+        """
+        Execute all tool calls from response content.
+
+        Multiple tool calls run in parallel on a thread pool so their
+        vector store lookups overlap.
+
+        Args:
+            content_blocks: Response content containing tool_use blocks
+            tool_manager: Manager to execute tools; see _call_managers for how
+                parallel calls keep their sources apart
+
+        Returns:
+            List of tool result dictionaries, in the order the tools were requested
+        """
+        tool_blocks = self._tool_use_blocks(content_blocks)
+        if len(tool_blocks) == 1:
+            # A single call gains nothing from the pool
+            return [self._run_tool(tool_manager, tool_blocks[0])]
+
+        call_managers = self._call_managers(tool_manager, len(tool_blocks))
+        futures = [
+            self._pool.submit(self._run_tool, call_manager, block)
+            for call_manager, block in zip(call_managers, tool_blocks)
+        ]
+        tool_results = [future.result() for future in futures]
+
+        self._adopt_call_sources(tool_manager, call_managers)
+        return tool_results
+
+    @staticmethod
+    def _call_managers(tool_manager, count: int) -> List[Any]:
+        """
+        Give each of count parallel tool calls a manager of its own.
+
+        A ToolManager hands out per-call copies via for_request, so concurrent
+        searches can't overwrite each other's sources. Managers without
+        for_request run every call on themselves, sharing their sources as a
+        single manager always has.
+        """
+        for_request = getattr(tool_manager, "for_request", None)
+        if for_request is None:
+            return [tool_manager] * count
+        return [for_request() for _ in range(count)]
+
+    @staticmethod
+    def _adopt_call_sources(tool_manager, call_managers: List[Any]) -> None:
+        """Merge per-call sources back in request order; the last request wins"""
+        for call_manager in call_managers:
+            if call_manager is not tool_manager:
+                tool_manager.adopt_sources(call_manager)
+
+    @staticmethod
+    def _run_tool(tool_manager, block) -> Dict[str, Any]:
+        """Execute one tool_use block, reporting failures as an error result"""
+        try:
+            tool_result = tool_manager.execute_tool(block.name, **block.input)
+        except Exception as e:
+            # Add error as tool result for graceful degradation
+            return {
+                "type": "tool_result",
+                "tool_use_id": block.id,
+                "content": f"Error executing tool: {str(e)}",
+                "is_error": True,
+            }
+
+        return {
+            "type": "tool_result",
+            "tool_use_id": block.id,
+            "content": tool_result,
         }
 
-        final_response = self.client.messages.create(**final_params)
-        return self._extract_text_response(final_response)
+    @staticmethod
+    def _tool_use_blocks(content_blocks) -> List[Any]:
+        """Select the tool_use blocks from response content, in order"""
+        return [
+            block
+            for block in content_blocks
+            if getattr(block, "type", None) == "tool_use"
+        ]
+
+    async def _aexecute_tools(
+        self, content_blocks, tool_manager
+    ) -> List[Dict[str, Any]]:
+        """
+        Execute all tool calls from response content concurrently.
+
+        Tools run in worker threads so blocking vector store queries overlap.
+
+        Args:
+            content_blocks: Response content containing tool_use blocks
+            tool_manager: Manager to execute tools
+
+        Returns:
+            List of tool result dictionaries, in the order the tools were requested
+        """
+        tool_blocks = self._tool_use_blocks(content_blocks)
+        if len(tool_blocks) == 1:
+            return [
+                await asyncio.to_thread(self._run_tool, tool_manager, tool_blocks[0])
+            ]
+
+        call_managers = self._call_managers(tool_manager, len(tool_blocks))
+        tool_results = await asyncio.gather(
+            *(
+                asyncio.to_thread(self._run_tool, call_manager, block)
+                for call_manager, block in zip(call_managers, tool_blocks)
+            )
+        )
+
+        self._adopt_call_sources(tool_manager, call_managers)
+        return list(tool_results)
+
+    def _extract_text_response(self, response) -> str:
+        """
+        Extract text content from API response.
+
+        Args:
+            response: API response object
+
+        Returns:
+            Text string from response
+        """
+        content = response.content
+
+        # Fast path: a single leading text block is by far the common case
+        if content:
+            first = content[0]
+            if getattr(first, "type", None) == "text":
+                return first.text
+
+        for content_block in content:
+            if getattr(content_block, "type", None) == "text":
+                return content_block.text
+
+        for content_block in content:
+            # Handle mock objects or direct text attributes
+            text = getattr(content_block, "text", None)
+            if isinstance(text, str):
+                return text
+
+        # Fallback if no text found
+        return self.FALLBACK_RESPONSE
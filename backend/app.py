@@ -2,15 +2,20 @@ import warnings
 
 warnings.filterwarnings("ignore", message="resource_tracker: There appear to be.*")
 
+import asyncio
+import json
 import os
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
-from config import config
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+
+from ai_generator import close_async_http
+from config import config
 from rag_system import RAGSystem
 
 # Initialize FastAPI app
@@ -69,18 +74,38 @@ async def query_documents(request: QueryRequest):
             session_id = rag_system.session_manager.create_session()
 
         # Process query using RAG system
-        answer, sources = rag_system.query(request.query, session_id)
+        answer, sources = await rag_system.aquery(request.query, session_id)
 
         return QueryResponse(answer=answer, sources=sources, session_id=session_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/query/stream")
+async def query_documents_stream(request: QueryRequest):
+    """Process a query and stream the response as server-sent events"""
+    session_id = request.session_id
+    if not session_id:
+        session_id = rag_system.session_manager.create_session()
+
+    def event_stream() -> Iterator[str]:
+        try:
+            for event in rag_system.query_stream(request.query, session_id):
+                if event["type"] == "sources":
+                    event = {**event, "session_id": session_id}
+                yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            yield f"data: {json.dumps({'type': 'error', 'detail': str(e)})}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @app.get("/api/courses", response_model=CourseStats)
 async def get_course_stats():
     """Get course analytics and statistics"""
     try:
-        analytics = rag_system.get_course_analytics()
+        # Vector store reads block, so keep them off the event loop
+        analytics = await asyncio.to_thread(rag_system.get_course_analytics)
         return CourseStats(
             total_courses=analytics["total_courses"],
             course_titles=analytics["course_titles"],
@@ -104,6 +129,12 @@ async def startup_event():
             print(f"Error loading documents: {e}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close the async Anthropic connection pool opened on the server's loop"""
+    await close_async_http()
+
+
 import os
 from pathlib import Path
 
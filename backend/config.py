@@ -23,7 +23,14 @@ class Config:
     CHUNK_OVERLAP: int = 100  # Characters to overlap between chunks
     MAX_RESULTS: int = 5  # Maximum search results to return
     MAX_HISTORY: int = 2  # Number of conversation messages to remember
-    MAX_TOOL_ROUNDS: int = 2  # Maximum sequential tool calling rounds
+    MAX_API_CALLS: int = 3  # Claude calls per query (2 tool rounds + the answer)
+    MAX_API_RETRIES: int = 3  # Retries for rate limit, 5xx and connection errors
+    MAX_INPUT_TOKENS: int = 150_000  # Prompt budget; oldest history turns dropped
+    MAX_OUTPUT_TOKENS: int = 800  # Default output cap per Claude call
+
+    # Response cache settings
+    RESPONSE_CACHE_SIZE: int = 256  # Cached responses to keep (0 disables)
+    RESPONSE_CACHE_TTL: int = 3600  # Seconds before a cached response expires
 
     # Database paths
     CHROMA_PATH: str = "./chroma_db"  # ChromaDB storage location
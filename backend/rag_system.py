@@ -1,9 +1,10 @@
 import os
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from ai_generator import AIGenerator
 from document_processor import DocumentProcessor
 from models import Course, CourseChunk, Lesson
+from response_cache import ResponseCache
 from search_tools import CourseOutlineTool, CourseSearchTool, ToolManager
 from session_manager import SessionManager
 from vector_store import VectorStore
@@ -23,9 +24,17 @@ class RAGSystem:
             config.CHROMA_PATH, config.EMBEDDING_MODEL, config.MAX_RESULTS
         )
         self.ai_generator = AIGenerator(
-            config.ANTHROPIC_API_KEY, config.ANTHROPIC_MODEL, config.MAX_TOOL_ROUNDS
+            config.ANTHROPIC_API_KEY,
+            config.ANTHROPIC_MODEL,
+            config.MAX_API_CALLS,
+            config.MAX_API_RETRIES,
+            config.MAX_INPUT_TOKENS,
+            config.MAX_OUTPUT_TOKENS,
         )
         self.session_manager = SessionManager(config.MAX_HISTORY)
+        self.response_cache = ResponseCache(
+            config.RESPONSE_CACHE_SIZE, config.RESPONSE_CACHE_TTL
+        )
 
         # Initialize search tools
         self.tool_manager = ToolManager()
@@ -132,6 +141,91 @@ class RAGSystem:
         Returns:
             Tuple of (response, sources list - empty for tool-based approach)
         """
+        request, cache_key, cached = self._lookup_cached(query, session_id)
+        if cached is None:
+            # Generate response using AI with tools; sources are tracked per request
+            tool_manager = self.tool_manager.for_request()
+            response = self.ai_generator.generate_response(
+                **request, tool_manager=tool_manager
+            )
+            cached = self._store_result(cache_key, response, tool_manager)
+
+        # Return response with sources from tool searches
+        return self._record_exchange(query, session_id, *cached)
+
+    async def aquery(
+        self, query: str, session_id: Optional[str] = None
+    ) -> Tuple[str, List[str]]:
+        """
+        Async version of query that awaits the AI generator without blocking.
+
+        Args:
+            query: User's question
+            session_id: Optional session ID for conversation context
+
+        Returns:
+            Tuple of (response, sources list)
+        """
+        request, cache_key, cached = self._lookup_cached(query, session_id)
+        if cached is None:
+            tool_manager = self.tool_manager.for_request()
+            response = await self.ai_generator.agenerate_response(
+                **request, tool_manager=tool_manager
+            )
+            cached = self._store_result(cache_key, response, tool_manager)
+
+        return self._record_exchange(query, session_id, *cached)
+
+    def query_stream(
+        self, query: str, session_id: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Process a user query and stream the response as it is generated.
+
+        Args:
+            query: User's question
+            session_id: Optional session ID for conversation context
+
+        Yields:
+            {"type": "text", "text": chunk} events, followed by a final
+            {"type": "sources", "sources": [...]} event
+        """
+        request, cache_key, cached = self._lookup_cached(query, session_id)
+        if cached is None:
+            tool_manager = self.tool_manager.for_request()
+            stream = self.ai_generator.generate_response_stream(
+                **request, tool_manager=tool_manager
+            )
+            while True:
+                try:
+                    chunk = next(stream)
+                except StopIteration as done:
+                    # The stream may include text from tool rounds; cache and
+                    # record only the final answer, as generate_response returns it
+                    response = done.value
+                    break
+                yield {"type": "text", "text": chunk}
+            cached = self._store_result(cache_key, response, tool_manager)
+        else:
+            yield {"type": "text", "text": cached[0]}
+
+        _, sources = self._record_exchange(query, session_id, *cached)
+        yield {"type": "sources", "sources": sources}
+
+    def _lookup_cached(
+        self, query: str, session_id: Optional[str]
+    ) -> Tuple[Dict[str, Any], str, Optional[Tuple[str, List[Dict[str, Any]]]]]:
+        """
+        Build the AI generator arguments for a query and look up a cached answer.
+
+        Args:
+            query: User's question
+            session_id: Optional session ID for conversation context
+
+        Returns:
+            Tuple of (generator keyword arguments without tool_manager, cache key,
+            cached (response, sources) or None)
+        """
         # Create prompt for the AI with clear instructions
         prompt = f"""Answer this question about course materials: {query}"""
 
@@ -140,26 +234,63 @@ class RAGSystem:
         if session_id:
             history = self.session_manager.get_conversation_history(session_id)
 
-        # Generate response using AI with tools
-        response = self.ai_generator.generate_response(
-            query=prompt,
-            conversation_history=history,
-            tools=self.tool_manager.get_tool_definitions(),
-            tool_manager=self.tool_manager,
-        )
+        tools = self.tool_manager.get_tool_definitions()
+        request = {"query": prompt, "conversation_history": history, "tools": tools}
+
+        # Serve identical requests from the response cache (temperature is 0)
+        cache_key = self._response_cache_key(prompt, history, tools)
+        return request, cache_key, self.response_cache.get(cache_key)
 
-        # Get sources from the search tool
-        sources = self.tool_manager.get_last_sources()
+    def _store_result(
+        self, cache_key: str, response: str, tool_manager: ToolManager
+    ) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Collect the sources behind a generated response and cache both.
 
-        # Reset sources after retrieving them
-        self.tool_manager.reset_sources()
+        Fallback answers and answers built after a tool failed are returned
+        but not cached, so a transient failure isn't served for the whole TTL.
 
-        # Update conversation history
+        Args:
+            cache_key: Key from _lookup_cached
+            response: Generated answer
+            tool_manager: The request's own manager from ToolManager.for_request
+
+        Returns:
+            Tuple of (response, sources)
+        """
+        # Sources come from this request's tools, so concurrent queries can't mix
+        sources = tool_manager.get_last_sources()
+
+        # Cache the response together with the sources it was built from
+        result = (response, list(sources))
+        degraded = (
+            response == self.ai_generator.FALLBACK_RESPONSE or tool_manager.tool_failed
+        )
+        if not degraded:
+            self.response_cache.set(cache_key, result)
+        return result
+
+    def _record_exchange(
+        self,
+        query: str,
+        session_id: Optional[str],
+        response: str,
+        sources: List[Dict[str, Any]],
+    ) -> Tuple[str, List[Dict[str, Any]]]:
+        """Add the exchange to the session history and return a copy of the result"""
         if session_id:
             self.session_manager.add_exchange(session_id, query, response)
+        return response, list(sources)
 
-        # Return response with sources from tool searches
-        return response, sources
+    def _response_cache_key(
+        self, prompt: str, history: Optional[str], tools: List[Dict[str, Any]]
+    ) -> str:
+        """Build the response cache key for a prompt, history and tool set"""
+        return ResponseCache.make_key(
+            query=prompt,
+            history=history,
+            tools=[tool["name"] for tool in tools],
+        )
 
     def get_course_analytics(self) -> Dict:
         """Get analytics about the course catalog"""
@@ -0,0 +1,57 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class ResponseCache:
+    """In-process LRU cache with per-entry TTL for generated responses"""
+
+    def __init__(self, max_size: int = 256, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(**parts: Any) -> str:
+        """Build a stable cache key from JSON-serializable request parts"""
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entry when full"""
+        if self.max_size <= 0:
+            return
+
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all cached entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
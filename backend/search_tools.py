@@ -1,3 +1,4 @@
+import copy
 from abc import ABC, abstractmethod
 from typing import Any, Dict, Optional, Protocol
 
@@ -203,6 +204,7 @@ class ToolManager:
 
     def __init__(self):
         self.tools = {}
+        self.tool_failed = False  # Set when a tool raised during execution
 
     def register_tool(self, tool: Tool):
         """Register any tool that implements the Tool interface"""
@@ -221,7 +223,11 @@ class ToolManager:
         if tool_name not in self.tools:
             return f"Tool '{tool_name}' not found"
 
-        return self.tools[tool_name].execute(**kwargs)
+        try:
+            return self.tools[tool_name].execute(**kwargs)
+        except Exception:
+            self.tool_failed = True
+            raise
 
     def get_last_sources(self) -> list:
         """Get sources from the last search operation"""
@@ -236,3 +242,19 @@ class ToolManager:
         for tool in self.tools.values():
             if hasattr(tool, "last_sources"):
                 tool.last_sources = []
+
+    def for_request(self) -> "ToolManager":
+        """Return a manager whose tools track sources for a single request"""
+        manager = ToolManager()
+        for name, tool in self.tools.items():
+            manager.tools[name] = copy.copy(tool)
+        manager.reset_sources()
+        return manager
+
+    def adopt_sources(self, other: "ToolManager"):
+        """Take over the sources (and any failure) another manager recorded"""
+        self.tool_failed = self.tool_failed or other.tool_failed
+        for name, tool in other.tools.items():
+            sources = getattr(tool, "last_sources", None)
+            if sources and name in self.tools:
+                self.tools[name].last_sources = sources
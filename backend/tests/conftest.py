@@ -3,10 +3,11 @@
 import shutil
 import tempfile
 from pathlib import Path
-from typing import Any, Dict, List
-from unittest.mock import MagicMock, Mock
+from typing import Any, Dict, List, Optional
+from unittest.mock import AsyncMock, MagicMock, Mock
 
 import pytest
+
 from ai_generator import AIGenerator
 from config import Config
 from models import Course, CourseChunk, Lesson
@@ -14,7 +15,44 @@ from search_tools import CourseSearchTool, ToolManager
 from vector_store import SearchResults, VectorStore
 
 
-@pytest.fixture
+def pytest_addoption(parser):
+    parser.addoption(
+        "--run-live",
+        action="store_true",
+        default=False,
+        help="run tests marked live against the real course database",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip live tests unless --run-live is given"""
+    if config.getoption("--run-live"):
+        return
+
+    skip_live = pytest.mark.skip(reason="needs --run-live")
+    for item in items:
+        if "live" in item.keywords:
+            item.add_marker(skip_live)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _warm_embedding_model(request):
+    """Load the sentence-transformer model once before any live test runs"""
+    if not request.config.getoption("--run-live"):
+        return
+    if not any("live" in item.keywords for item in request.session.items):
+        return
+
+    from chromadb.utils.embedding_functions import (
+        SentenceTransformerEmbeddingFunction,
+    )
+
+    # Chroma caches loaded models per name, so every VectorStore built
+    # afterwards reuses this one instead of loading the weights again
+    SentenceTransformerEmbeddingFunction(model_name=Config().EMBEDDING_MODEL)
+
+
+@pytest.fixture(scope="session")
 def sample_course():
     """Sample course with lessons for testing"""
     return Course(
@@ -36,7 +74,7 @@ def sample_course():
     )
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_chunks():
     """Sample course chunks for testing"""
     return [
@@ -61,7 +99,7 @@ def sample_chunks():
     ]
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_search_results():
     """Sample search results for testing"""
     return SearchResults(
@@ -85,12 +123,32 @@ def sample_search_results():
     )
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def empty_search_results():
     """Empty search results for testing"""
     return SearchResults(documents=[], metadata=[], distances=[])
 
 
+@pytest.fixture(scope="session")
+def make_results():
+    """Factory for SearchResults whose documents all come from one course/lesson"""
+
+    def _make(
+        documents, course_title=None, lesson_number=None, distance=0.1, error=None
+    ):
+        meta = {"course_title": course_title}
+        if lesson_number is not None:
+            meta["lesson_number"] = lesson_number
+        return SearchResults(
+            documents=documents,
+            metadata=[dict(meta) for _ in documents],
+            distances=[distance] * len(documents),
+            error=error,
+        )
+
+    return _make
+
+
 @pytest.fixture
 def mock_vector_store(sample_search_results):
     """Mock VectorStore that returns sample results"""
@@ -100,49 +158,6 @@ def mock_vector_store(sample_search_results):
     return mock_store
 
 
-@pytest.fixture
-def mock_anthropic_client():
-    """Mock Anthropic client for testing AI generator"""
-    mock_client = Mock()
-
-    # Create mock response without tool use
-    mock_response = Mock()
-    mock_response.stop_reason = "end_turn"
-    mock_response.content = [Mock(text="This is a test response")]
-
-    mock_client.messages.create.return_value = mock_response
-    return mock_client
-
-
-@pytest.fixture
-def mock_anthropic_client_with_tools():
-    """Mock Anthropic client that simulates tool calling"""
-    mock_client = Mock()
-
-    # First response: Claude requests to use a tool
-    tool_use_response = Mock()
-    tool_use_response.stop_reason = "tool_use"
-
-    # Mock tool use content block
-    tool_block = Mock()
-    tool_block.type = "tool_use"
-    tool_block.name = "search_course_content"
-    tool_block.id = "tool_123"
-    tool_block.input = {"query": "What is MCP?"}
-
-    tool_use_response.content = [tool_block]
-
-    # Second response: Final answer after tool execution
-    final_response = Mock()
-    final_response.stop_reason = "end_turn"
-    final_response.content = [Mock(text="MCP stands for Model Context Protocol.")]
-
-    # Return different responses on consecutive calls
-    mock_client.messages.create.side_effect = [tool_use_response, final_response]
-
-    return mock_client
-
-
 @pytest.fixture
 def temp_chroma_db():
     """Create a temporary ChromaDB directory for testing"""
@@ -194,36 +209,73 @@ def tool_manager(search_tool):
 # API Testing Fixtures
 # ============================================================================
 
-@pytest.fixture
-def mock_rag_system():
-    """Mock RAGSystem for API testing"""
-    mock_rag = Mock()
 
-    # Mock query method to return predictable responses
-    mock_rag.query.return_value = (
-        "This is a test answer about MCP.",
-        [{"text": "Introduction to MCP - Lesson 1", "link": "https://example.com/lesson1"}]
+def _configure_mock_rag_system(mock_rag):
+    """Give the RAG mock its predictable query, analytics and session responses"""
+    mock_rag.reset_mock(return_value=True, side_effect=True)
+
+    # Set in one batch
+    mock_rag.configure_mock(
+        **{
+            "aquery.return_value": (
+                "This is a test answer about MCP.",
+                [
+                    {
+                        "text": "Introduction to MCP - Lesson 1",
+                        "link": "https://example.com/lesson1",
+                    }
+                ],
+            ),
+            "get_course_analytics.return_value": {
+                "total_courses": 2,
+                "course_titles": ["Introduction to MCP", "Advanced Python"],
+            },
+            "session_manager.create_session.return_value": "test_session_123",
+            "query_stream.side_effect": lambda query, session_id: iter(
+                [
+                    {"type": "text", "text": "This is a test answer about MCP."},
+                    {
+                        "type": "sources",
+                        "sources": [
+                            {
+                                "text": "Introduction to MCP - Lesson 1",
+                                "link": "https://example.com/lesson1",
+                            }
+                        ],
+                    },
+                ]
+            ),
+        }
     )
 
-    # Mock get_course_analytics method
-    mock_rag.get_course_analytics.return_value = {
-        "total_courses": 2,
-        "course_titles": ["Introduction to MCP", "Advanced Python"]
-    }
-
-    # Mock session manager
-    mock_rag.session_manager.create_session.return_value = "test_session_123"
 
+@pytest.fixture(scope="module")
+def mock_rag_system():
+    """Mock RAGSystem for API testing, shared by the module's test app"""
+    mock_rag = Mock()
+    mock_rag.aquery = AsyncMock()
+    _configure_mock_rag_system(mock_rag)
     return mock_rag
 
 
-@pytest.fixture
+@pytest.fixture(autouse=True)
+def _reset_mock_rag_system(request):
+    """Restore the shared RAG mock after each test that used it"""
+    yield
+    if "mock_rag_system" in request.fixturenames:
+        _configure_mock_rag_system(request.getfixturevalue("mock_rag_system"))
+
+
+@pytest.fixture(scope="module")
 def test_app(mock_rag_system):
     """FastAPI test application without static file mounting"""
+    import asyncio
+    import json
+
     from fastapi import FastAPI, HTTPException
     from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import StreamingResponse
     from pydantic import BaseModel
-    from typing import List, Optional, Dict, Any
 
     # Create a minimal app for testing
     app = FastAPI(title="Course Materials RAG System - Test")
@@ -255,19 +307,38 @@ def test_app(mock_rag_system):
     @app.post("/api/query", response_model=QueryResponse)
     async def query_documents(request: QueryRequest):
         try:
-            session_id = request.session_id or mock_rag_system.session_manager.create_session()
-            answer, sources = mock_rag_system.query(request.query, session_id)
+            session_id = (
+                request.session_id or mock_rag_system.session_manager.create_session()
+            )
+            answer, sources = await mock_rag_system.aquery(request.query, session_id)
             return QueryResponse(answer=answer, sources=sources, session_id=session_id)
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
+    @app.post("/api/query/stream")
+    async def query_documents_stream(request: QueryRequest):
+        session_id = (
+            request.session_id or mock_rag_system.session_manager.create_session()
+        )
+
+        def event_stream():
+            try:
+                for event in mock_rag_system.query_stream(request.query, session_id):
+                    if event["type"] == "sources":
+                        event = {**event, "session_id": session_id}
+                    yield f"data: {json.dumps(event)}\n\n"
+            except Exception as e:
+                yield f"data: {json.dumps({'type': 'error', 'detail': str(e)})}\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
     @app.get("/api/courses", response_model=CourseStats)
     async def get_course_stats():
         try:
-            analytics = mock_rag_system.get_course_analytics()
+            analytics = await asyncio.to_thread(mock_rag_system.get_course_analytics)
             return CourseStats(
                 total_courses=analytics["total_courses"],
-                course_titles=analytics["course_titles"]
+                course_titles=analytics["course_titles"],
             )
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
@@ -279,8 +350,9 @@ def test_app(mock_rag_system):
     return app
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def client(test_app):
-    """Test client for making API requests"""
+    """Test client for making API requests, reused across the module"""
     from fastapi.testclient import TestClient
+
     return TestClient(test_app)
@@ -1,46 +1,93 @@
 """Tests for AIGenerator tool calling functionality"""
 
-import os
-import sys
-from unittest.mock import MagicMock, Mock, patch
+import asyncio
+import functools
+import logging
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
 
 import pytest
 
-# Add backend to path for imports
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from ai_generator import AIGenerator, _async_http, close_async_http
 
-from ai_generator import AIGenerator
-from search_tools import CourseSearchTool, ToolManager
+_SEARCH_RESULTS = "[Course A]\nSome search results"
+
+
+class _FakeToolManager:
+    """Duck-typed ToolManager with only execute_tool, attached as a MagicMock"""
+
+
+def _make_tool_use_block(tool_id, tool_input):
+    """Build a tool_use content block calling search_course_content"""
+    block = Mock(type="tool_use", id=tool_id, input=tool_input)
+    # Mock(name=...) names the mock itself, so set the attribute afterwards
+    block.name = "search_course_content"
+    return block
+
+
+def _make_tool_use_response(*tool_inputs):
+    """Build a response calling search_course_content once per input (tool_1, ...)"""
+    response = Mock()
+    response.stop_reason = "tool_use"
+    response.content = [
+        _make_tool_use_block(f"tool_{i}", tool_input)
+        for i, tool_input in enumerate(tool_inputs, start=1)
+    ]
+    return response
+
+
+@functools.lru_cache(maxsize=None)
+def _make_final_response(text):
+    """Build a response in which Claude answers with text (cached, read-only)"""
+    response = Mock()
+    response.stop_reason = "end_turn"
+    response.content = [Mock(type="text", text=text)]
+    return response
+
+
+def _make_truncated_response(text):
+    """Build a response whose answer was cut off at max_tokens"""
+    return Mock(stop_reason="max_tokens", content=[Mock(type="text", text=text)])
 
 
 class TestAIGeneratorToolCalling:
     """Test suite for AIGenerator tool calling behavior"""
 
-    @pytest.fixture
+    @pytest.fixture(scope="module")
     def mock_anthropic_client(self):
-        """Create a mock Anthropic client"""
+        """Create a mock Anthropic client shared by the whole module"""
         with patch("ai_generator.anthropic.Anthropic") as mock_client_class:
             mock_client = Mock()
             mock_client_class.return_value = mock_client
             yield mock_client
 
-    @pytest.fixture
+    @pytest.fixture(scope="module")
     def ai_generator(self, mock_anthropic_client):
         """Create AIGenerator with mock client"""
         generator = AIGenerator(
-            api_key="test_key", model="claude-sonnet-4-20250514", max_tool_rounds=2
+            api_key="test_key", model="claude-sonnet-4-20250514", max_api_calls=3
         )
         generator.client = mock_anthropic_client
         return generator
 
-    @pytest.fixture
+    @pytest.fixture(scope="module")
     def mock_tool_manager(self):
-        """Create a mock ToolManager"""
-        manager = Mock(spec=ToolManager)
-        manager.execute_tool.return_value = "[Course A]\nSome search results"
+        """Create a fake ToolManager whose execute_tool records calls"""
+        manager = _FakeToolManager()
+        manager.execute_tool = MagicMock(return_value=_SEARCH_RESULTS)
         return manager
 
-    @pytest.fixture
+    @pytest.fixture(autouse=True)
+    def reset_shared_mocks(self, mock_anthropic_client, mock_tool_manager):
+        """Clear responses and calls configured by a test on the shared mocks"""
+        yield
+        mock_anthropic_client.reset_mock(return_value=True, side_effect=True)
+        mock_tool_manager.execute_tool.reset_mock(return_value=True, side_effect=True)
+        mock_tool_manager.execute_tool.return_value = _SEARCH_RESULTS
+
+    @pytest.fixture(scope="module")
     def sample_tools(self):
         """Sample tool definitions"""
         return [
@@ -58,9 +105,7 @@ class TestAIGeneratorToolCalling:
     def test_generate_response_without_tools(self, ai_generator, mock_anthropic_client):
         """Test basic response generation without tools"""
         # Mock response without tool use
-        mock_response = Mock()
-        mock_response.stop_reason = "end_turn"
-        mock_response.content = [Mock(type="text", text="This is a general answer")]
+        mock_response = _make_final_response("This is a general answer")
 
         mock_anthropic_client.messages.create.return_value = mock_response
 
@@ -74,59 +119,92 @@ class TestAIGeneratorToolCalling:
         assert result == "This is a general answer"
         assert mock_anthropic_client.messages.create.call_count == 1
 
-    def test_generate_response_with_tool_use(
-        self, ai_generator, mock_anthropic_client, mock_tool_manager, sample_tools
+    @pytest.mark.parametrize(
+        "tool_input,tool_side_effect,tool_rounds,expected_text",
+        [
+            pytest.param(
+                {"query": "What is MCP?"},
+                None,
+                1,
+                "MCP stands for Model Context Protocol",
+                id="single_round",
+            ),
+            pytest.param(
+                {"query": "test"},
+                Exception("Database error"),
+                1,
+                "I couldn't find that information",
+                id="tool_error",
+            ),
+            pytest.param(
+                {"query": "test"},
+                None,
+                2,
+                "Based on available information...",
+                id="max_rounds_reached",
+            ),
+            pytest.param(
+                {
+                    "query": "FastAPI basics",
+                    "course_name": "FastAPI Course",
+                    "lesson_number": 2,
+                },
+                None,
+                1,
+                "Answer",
+                id="all_parameters",
+            ),
+        ],
+    )
+    def test_tool_use_flow(
+        self,
+        ai_generator,
+        mock_anthropic_client,
+        mock_tool_manager,
+        sample_tools,
+        tool_input,
+        tool_side_effect,
+        tool_rounds,
+        expected_text,
     ):
-        """Test response generation when Claude calls a tool"""
-        # First response: Claude requests tool use
-        tool_use_response = Mock()
-        tool_use_response.stop_reason = "tool_use"
-        tool_use_content = Mock(
-            type="tool_use",
-            id="tool_123",
-            name="search_course_content",
-            input={"query": "What is MCP?"},
-        )
-        tool_use_response.content = [tool_use_content]
-
-        # Second response: Claude provides answer with tool results
-        final_response = Mock()
-        final_response.stop_reason = "end_turn"
-        final_response.content = [
-            Mock(type="text", text="MCP stands for Model Context Protocol")
-        ]
-
+        """Test tool calling rounds followed by a final text answer"""
         mock_anthropic_client.messages.create.side_effect = [
-            tool_use_response,
-            final_response,
-        ]
+            _make_tool_use_response(tool_input)
+        ] * tool_rounds + [_make_final_response(expected_text)]
+        mock_tool_manager.execute_tool.side_effect = tool_side_effect
 
         result = ai_generator.generate_response(
-            query="What is MCP?",
+            query="test query",
             conversation_history=None,
             tools=sample_tools,
             tool_manager=mock_tool_manager,
         )
 
-        # Verify tool was executed
-        mock_tool_manager.execute_tool.assert_called_once_with(
-            "search_course_content", query="What is MCP?"
+        # Every tool round runs the tool with the exact parameters Claude sent
+        assert mock_tool_manager.execute_tool.call_count == tool_rounds
+        mock_tool_manager.execute_tool.assert_called_with(
+            "search_course_content", **tool_input
         )
 
-        # Verify final answer
-        assert result == "MCP stands for Model Context Protocol"
+        # One call per tool round plus the final answer; the last allowed
+        # round disables tool use
+        assert mock_anthropic_client.messages.create.call_count == tool_rounds + 1
+        final_call = mock_anthropic_client.messages.create.call_args_list[-1]
+        expected_choice = (
+            "none" if tool_rounds + 1 == ai_generator.max_api_calls else "auto"
+        )
+        assert final_call.kwargs["tool_choice"] == {"type": expected_choice}
+        assert final_call.kwargs["tools"]
 
-        # Verify two API calls were made
-        assert mock_anthropic_client.messages.create.call_count == 2
+        # Should get the final answer, even when the tool raised
+        assert result == expected_text
 
     def test_generate_response_no_tool_use(
         self, ai_generator, mock_anthropic_client, mock_tool_manager, sample_tools
     ):
         """Test when Claude decides not to use tools"""
         # Claude responds directly without using tools
-        mock_response = Mock()
-        mock_response.stop_reason = "end_turn"
-        mock_response.content = [Mock(type="text", text="This is common knowledge")]
+        mock_response = _make_final_response("This is common knowledge")
 
         mock_anthropic_client.messages.create.return_value = mock_response
 
@@ -146,178 +224,387 @@ class TestAIGeneratorToolCalling:
         # Only one API call
         assert mock_anthropic_client.messages.create.call_count == 1
 
-    def test_tool_execution_error_handling(
+    def test_conversation_history_included(
         self, ai_generator, mock_anthropic_client, mock_tool_manager, sample_tools
     ):
-        """Test handling of tool execution errors"""
-        # First response: tool use
-        tool_use_response = Mock()
-        tool_use_response.stop_reason = "tool_use"
-        tool_use_content = Mock(
-            type="tool_use",
-            id="tool_123",
-            name="search_course_content",
-            input={"query": "test"},
-        )
-        tool_use_response.content = [tool_use_content]
-
-        # Tool execution raises an exception
-        mock_tool_manager.execute_tool.side_effect = Exception("Database error")
+        """Test that conversation history is included in system prompt"""
+        mock_response = _make_final_response("Context-aware response")
 
-        # Second response: Claude handles error
-        final_response = Mock()
-        final_response.stop_reason = "end_turn"
-        final_response.content = [
-            Mock(type="text", text="I couldn't find that information")
-        ]
+        mock_anthropic_client.messages.create.return_value = mock_response
 
-        mock_anthropic_client.messages.create.side_effect = [
-            tool_use_response,
-            final_response,
-        ]
+        history = (
+            "User: What is MCP?\nAssistant: MCP stands for Model Context Protocol."
+        )
 
         result = ai_generator.generate_response(
-            query="test query",
-            conversation_history=None,
+            query="Tell me more about it",
+            conversation_history=history,
             tools=sample_tools,
             tool_manager=mock_tool_manager,
         )
 
-        # Should still return a response
-        assert result == "I couldn't find that information"
+        # Check that system prompt includes history after the cached prompt
+        call_args = mock_anthropic_client.messages.create.call_args
+        system_blocks = call_args.kwargs.get("system", [])
 
-    def test_max_tool_rounds_reached(
-        self, ai_generator, mock_anthropic_client, mock_tool_manager, sample_tools
+        assert system_blocks[0]["text"] == ai_generator.system_prompt
+        assert system_blocks[0]["cache_control"] == {"type": "ephemeral"}
+        assert "Previous conversation" in system_blocks[1]["text"]
+        assert history in system_blocks[1]["text"]
+        assert "cache_control" not in system_blocks[1]
+
+    def test_conversation_history_trimmed_to_token_budget(
+        self, ai_generator, monkeypatch
     ):
-        """Test behavior when max tool rounds is reached"""
-        # Both calls result in tool use (max_tool_rounds=2)
-        tool_use_response = Mock()
-        tool_use_response.stop_reason = "tool_use"
-        tool_use_content = Mock(
-            type="tool_use",
-            id="tool_123",
-            name="search_course_content",
-            input={"query": "test"},
+        """Test that the oldest history turns are dropped when over budget"""
+        old_turns = "User: " + "old question " * 50 + "\nAssistant: old answer\n"
+        recent_turns = "User: What is MCP?\nAssistant: A protocol."
+        monkeypatch.setattr(
+            ai_generator,
+            "max_input_tokens",
+            ai_generator._estimate_tokens(ai_generator.system_prompt) + 14,
         )
-        tool_use_response.content = [tool_use_content]
 
-        # Final call without tools forces answer
-        final_response = Mock()
-        final_response.stop_reason = "end_turn"
-        final_response.content = [
-            Mock(type="text", text="Based on available information...")
-        ]
+        result = ai_generator._fit_history(old_turns + recent_turns, "Tell me more")
 
-        mock_anthropic_client.messages.create.side_effect = [
-            tool_use_response,  # Round 1
-            tool_use_response,  # Round 2
-            final_response,  # Final call without tools
-        ]
+        assert result == recent_turns
 
-        result = ai_generator.generate_response(
-            query="complex query",
-            conversation_history=None,
+        # History that already fits is passed through unchanged
+        assert ai_generator._fit_history(recent_turns, "Tell me more") == recent_turns
+
+    def test_prompt_caching_breakpoints(
+        self, ai_generator, mock_anthropic_client, mock_tool_manager, sample_tools
+    ):
+        """Test that the system prompt and tools are marked for prompt caching"""
+        mock_response = _make_final_response("Cached response")
+
+        mock_anthropic_client.messages.create.return_value = mock_response
+
+        ai_generator.generate_response(
+            query="What is MCP?",
             tools=sample_tools,
             tool_manager=mock_tool_manager,
         )
 
-        # Should make 3 calls: 2 with tools + 1 final without tools
-        assert mock_anthropic_client.messages.create.call_count == 3
+        call_args = mock_anthropic_client.messages.create.call_args
+        system_blocks = call_args.kwargs["system"]
+        tools = call_args.kwargs["tools"]
 
-        # Should get final answer
-        assert result == "Based on available information..."
+        assert len(system_blocks) == 1
+        assert system_blocks[0]["cache_control"] == {"type": "ephemeral"}
+        assert tools[-1]["cache_control"] == {"type": "ephemeral"}
 
-    def test_conversation_history_included(
-        self, ai_generator, mock_anthropic_client, mock_tool_manager, sample_tools
-    ):
-        """Test that conversation history is included in system prompt"""
-        mock_response = Mock()
-        mock_response.stop_reason = "end_turn"
-        mock_response.content = [Mock(type="text", text="Context-aware response")]
+        # Caller's tool definitions must not be mutated
+        assert "cache_control" not in sample_tools[-1]
+
+    def test_max_tokens_override(self, ai_generator, mock_anthropic_client):
+        """Test per-call max_tokens overrides the default"""
+        mock_response = _make_final_response("Short answer")
 
         mock_anthropic_client.messages.create.return_value = mock_response
 
-        history = (
-            "User: What is MCP?\nAssistant: MCP stands for Model Context Protocol."
-        )
+        ai_generator.generate_response(query="What is 2 + 2?")
+        default_call = mock_anthropic_client.messages.create.call_args
 
-        result = ai_generator.generate_response(
-            query="Tell me more about it",
-            conversation_history=history,
+        ai_generator.generate_response(query="What is 2 + 2?", max_tokens=100)
+        override_call = mock_anthropic_client.messages.create.call_args
+
+        assert default_call.kwargs["max_tokens"] == ai_generator.max_tokens
+        assert override_call.kwargs["max_tokens"] == 100
+
+    def test_truncated_answer_is_logged(
+        self, ai_generator, mock_anthropic_client, caplog
+    ):
+        """Test an answer cut off at max_tokens is returned with a warning"""
+        truncated = _make_truncated_response("A very long answer")
+        mock_anthropic_client.messages.create.return_value = truncated
+
+        with caplog.at_level(logging.WARNING, logger="ai_generator"):
+            result = ai_generator.generate_response(
+                query="Explain everything", max_tokens=100
+            )
+
+        assert result == "A very long answer"
+        assert mock_anthropic_client.messages.create.call_count == 1
+        assert "truncated at max_tokens=100" in caplog.text
+
+    def test_system_prompt_states_tool_round_budget(self):
+        """Test the prompt's round count follows max_api_calls"""
+        generator = AIGenerator(api_key="test_key", model="test", max_api_calls=4)
+
+        assert "(up to 3 rounds)" in generator.system_prompt
+
+    def test_system_prompt_meets_cache_minimum(self, ai_generator):
+        """Test the system prompt clears the cache minimum with room to spare"""
+        # Pessimistic 5 characters per token (English prose is nearer 4) plus a
+        # 20% margin; test_live_system measures the real count with the API
+        prompt_tokens = len(ai_generator.system_prompt) // 5
+
+        assert prompt_tokens >= ai_generator.MIN_CACHEABLE_TOKENS * 1.2
+
+    def test_generate_response_stream_with_tool_use(
+        self, ai_generator, mock_anthropic_client, mock_tool_manager, sample_tools
+    ):
+        """Test streaming executes tools between rounds and yields answer text"""
+        tool_use_response = _make_tool_use_response({"query": "What is MCP?"})
+        tool_use_response.content.insert(0, Mock(type="text", text="Let me search."))
+        final_response = _make_final_response("MCP stands for Model Context Protocol")
+
+        def make_stream(chunks, final_message):
+            stream = MagicMock()
+            stream.__enter__.return_value.text_stream = iter(chunks)
+            stream.__enter__.return_value.get_final_message.return_value = final_message
+            return stream
+
+        mock_anthropic_client.messages.stream.side_effect = [
+            make_stream(["Let me search."], tool_use_response),
+            make_stream(["MCP stands for ", "Model Context Protocol"], final_response),
+        ]
+
+        stream = ai_generator.generate_response_stream(
+            query="What is MCP?",
             tools=sample_tools,
             tool_manager=mock_tool_manager,
         )
+        chunks = []
+        while True:
+            try:
+                chunks.append(next(stream))
+            except StopIteration as done:
+                answer = done.value
+                break
+
+        # Tool round text is streamed apart from the answer but not returned
+        assert chunks == [
+            "Let me search.",
+            "\n\n",
+            "MCP stands for ",
+            "Model Context Protocol",
+        ]
+        assert answer == "MCP stands for Model Context Protocol"
+        mock_tool_manager.execute_tool.assert_called_once_with(
+            "search_course_content", query="What is MCP?"
+        )
+        assert mock_anthropic_client.messages.stream.call_count == 2
 
-        # Check that system prompt includes history
-        call_args = mock_anthropic_client.messages.create.call_args
-        system_content = call_args.kwargs.get("system", "")
+    def test_agenerate_response_executes_tools_concurrently(
+        self, ai_generator, mock_tool_manager, sample_tools, monkeypatch
+    ):
+        """Test async generation runs all tool calls and keeps result order"""
+        tool_use_response = _make_tool_use_response({"query": "MCP"}, {"query": "RAG"})
+        final_response = _make_final_response("Combined answer")
 
-        assert "Previous conversation" in system_content
-        assert history in system_content
+        aclient = Mock()
+        aclient.messages.create = AsyncMock(
+            side_effect=[tool_use_response, final_response]
+        )
+        monkeypatch.setattr(AIGenerator, "aclient", aclient)
 
-    def test_extract_text_response_with_multiple_blocks(self, ai_generator):
-        """Test extracting text from response with multiple content blocks"""
-        mock_response = Mock()
-        mock_response.content = [
-            Mock(type="thinking", text="Let me think..."),
-            Mock(type="text", text="Here is the answer"),
-            Mock(type="metadata", data={}),
-        ]
+        def execute_tool(name, query):
+            if query == "RAG":
+                raise Exception("Database error")
+            return f"results for {query}"
 
-        result = ai_generator._extract_text_response(mock_response)
+        mock_tool_manager.execute_tool.side_effect = execute_tool
 
-        # Should extract the text block
-        assert result == "Here is the answer"
+        result = asyncio.run(
+            ai_generator.agenerate_response(
+                query="Compare MCP and RAG",
+                tools=sample_tools,
+                tool_manager=mock_tool_manager,
+            )
+        )
 
-    def test_extract_text_response_no_text(self, ai_generator):
-        """Test extracting text when no text block exists"""
-        mock_response = Mock()
-        mock_response.content = [Mock(type="metadata", data={})]
+        assert result == "Combined answer"
+        assert mock_tool_manager.execute_tool.call_count == 2
 
-        result = ai_generator._extract_text_response(mock_response)
+        # Tool results are sent back in request order, errors included
+        second_call = aclient.messages.create.call_args_list[1]
+        tool_results = second_call.kwargs["messages"][-1]["content"]
+        assert [r["tool_use_id"] for r in tool_results] == ["tool_1", "tool_2"]
+        assert tool_results[0]["content"] == "results for MCP"
+        assert tool_results[1]["is_error"] is True
 
-        # Should return fallback message
-        assert "couldn't generate a response" in result
+    def test_async_http_pool_is_per_event_loop(self):
+        """Test each event loop gets its own async pool, closed on request"""
 
-    def test_tool_parameters_passed_correctly(
-        self, ai_generator, mock_anthropic_client, mock_tool_manager, sample_tools
+        async def open_and_close():
+            client = _async_http()
+            assert _async_http() is client
+            await close_async_http()
+            return client
+
+        first = asyncio.run(open_and_close())
+        second = asyncio.run(open_and_close())
+
+        assert first is not second
+        assert first.is_closed and second.is_closed
+
+    def test_execute_tools_runs_calls_in_parallel(
+        self, ai_generator, mock_tool_manager
     ):
-        """Test that tool parameters are passed correctly"""
-        tool_use_response = Mock()
-        tool_use_response.stop_reason = "tool_use"
-        tool_use_content = Mock(
-            type="tool_use",
-            id="tool_123",
-            name="search_course_content",
-            input={
-                "query": "FastAPI basics",
-                "course_name": "FastAPI Course",
-                "lesson_number": 2,
-            },
+        """Test sync tool execution overlaps calls and keeps result order"""
+        content = _make_tool_use_response({"query": "MCP"}, {"query": "RAG"}).content
+
+        # Each call waits for the other, so this only passes if they overlap
+        barrier = threading.Barrier(2, timeout=5)
+
+        def execute_tool(name, query):
+            barrier.wait()
+            return f"results for {query}"
+
+        mock_tool_manager.execute_tool.side_effect = execute_tool
+
+        tool_results = ai_generator._execute_tools(content, mock_tool_manager)
+
+        assert [r["tool_use_id"] for r in tool_results] == ["tool_1", "tool_2"]
+        assert [r["content"] for r in tool_results] == [
+            "results for MCP",
+            "results for RAG",
+        ]
+
+    def test_parallel_tools_on_manager_without_for_request(
+        self, ai_generator, mock_tool_manager
+    ):
+        """Test managers lacking for_request/adopt_sources still run parallel calls"""
+        content = _make_tool_use_response({"query": "MCP"}, {"query": "RAG"}).content
+        assert not hasattr(mock_tool_manager, "for_request")
+
+        tool_results = ai_generator._execute_tools(content, mock_tool_manager)
+        async_results = asyncio.run(
+            ai_generator._aexecute_tools(content, mock_tool_manager)
         )
-        tool_use_response.content = [tool_use_content]
 
-        final_response = Mock()
-        final_response.stop_reason = "end_turn"
-        final_response.content = [Mock(type="text", text="Answer")]
+        assert tool_results == async_results
+        assert [r["content"] for r in tool_results] == [_SEARCH_RESULTS] * 2
+        assert mock_tool_manager.execute_tool.call_count == 4
 
-        mock_anthropic_client.messages.create.side_effect = [
-            tool_use_response,
-            final_response,
+    def test_execute_tools_runs_single_call_inline(
+        self, ai_generator, mock_tool_manager, monkeypatch
+    ):
+        """Test a lone tool call skips the thread pool"""
+        content = _make_tool_use_response({"query": "MCP"}).content
+        monkeypatch.setattr(ai_generator, "_pool", Mock())
+
+        tool_results = ai_generator._execute_tools(content, mock_tool_manager)
+
+        ai_generator._pool.submit.assert_not_called()
+        assert tool_results == [
+            {"type": "tool_result", "tool_use_id": "tool_1", "content": _SEARCH_RESULTS}
         ]
 
-        result = ai_generator.generate_response(
-            query="test", tools=sample_tools, tool_manager=mock_tool_manager
+    def test_parallel_tool_sources_follow_request_order(
+        self, ai_generator, tool_manager, mock_vector_store, make_results
+    ):
+        """Test parallel searches report the last requested search's sources"""
+        content = _make_tool_use_response({"query": "MCP"}, {"query": "RAG"}).content
+
+        def search(query, **kwargs):
+            # The first requested search finishes last
+            if query == "MCP":
+                time.sleep(0.05)
+            return make_results([f"About {query}"], f"{query} course", 1)
+
+        mock_vector_store.search.side_effect = search
+
+        ai_generator._execute_tools(content, tool_manager)
+        assert tool_manager.get_last_sources() == [
+            {"text": "RAG course - Lesson 1", "link": "https://example.com/mcp/lesson1"}
+        ]
+
+        tool_manager.reset_sources()
+        asyncio.run(ai_generator._aexecute_tools(content, tool_manager))
+        assert tool_manager.get_last_sources() == [
+            {"text": "RAG course - Lesson 1", "link": "https://example.com/mcp/lesson1"}
+        ]
+
+    def test_generate_batch_returns_results_in_input_order(
+        self, ai_generator, mock_anthropic_client, caplog
+    ):
+        """Test batch generation polls until done and orders results by query"""
+        pending = Mock(id="batch_1", processing_status="in_progress")
+        ended = Mock(id="batch_1", processing_status="ended")
+        mock_anthropic_client.messages.batches.create.return_value = pending
+        mock_anthropic_client.messages.batches.retrieve.return_value = ended
+
+        def batch_result(custom_id, text):
+            entry = Mock(custom_id=custom_id)
+            entry.result.type = "succeeded"
+            entry.result.message.content = [Mock(type="text", text=text)]
+            return entry
+
+        errored = Mock(custom_id="q2")
+        errored.result.type = "errored"
+        errored.result.error = "overloaded_error"
+
+        mock_anthropic_client.messages.batches.results.return_value = [
+            batch_result("q1", "Second answer"),
+            errored,
+            batch_result("q0", "First answer"),
+        ]
+
+        with caplog.at_level(logging.WARNING, logger="ai_generator"):
+            results = ai_generator.generate_batch(
+                ["First?", "Second?", "Third?"], poll_interval=0
+            )
+
+        assert results[:2] == ["First answer", "Second answer"]
+        assert "couldn't generate a response" in results[2]
+        assert "q2 errored: overloaded_error" in caplog.text
+
+        requests = mock_anthropic_client.messages.batches.create.call_args.kwargs[
+            "requests"
+        ]
+        assert [r["custom_id"] for r in requests] == ["q0", "q1", "q2"]
+        assert "tools" not in requests[0]["params"]
+        mock_anthropic_client.messages.batches.retrieve.assert_called_once_with(
+            "batch_1"
         )
 
-        # Verify all parameters were passed to execute_tool
-        mock_tool_manager.execute_tool.assert_called_once_with(
-            "search_course_content",
-            query="FastAPI basics",
-            course_name="FastAPI Course",
-            lesson_number=2,
+    def test_generate_batch_rejects_mismatched_histories(
+        self, ai_generator, mock_anthropic_client
+    ):
+        """Test batch generation refuses histories that don't match the queries"""
+        with pytest.raises(ValueError):
+            ai_generator.generate_batch(["First?", "Second?"], histories=[None])
+
+        mock_anthropic_client.messages.batches.create.assert_not_called()
+
+    def test_generate_batch_cancels_after_timeout(
+        self, ai_generator, mock_anthropic_client
+    ):
+        """Test batch generation gives up and cancels a batch that never ends"""
+        pending = Mock(id="batch_1", processing_status="in_progress")
+        mock_anthropic_client.messages.batches.create.return_value = pending
+        mock_anthropic_client.messages.batches.retrieve.return_value = pending
+
+        with pytest.raises(TimeoutError):
+            ai_generator.generate_batch(["First?"], poll_interval=0, timeout=0)
+
+        mock_anthropic_client.messages.batches.cancel.assert_called_once_with("batch_1")
+
+    def test_extract_text_response_with_multiple_blocks(self, ai_generator):
+        """Test extracting text from response with multiple content blocks"""
+        mock_response = SimpleNamespace(
+            content=[
+                SimpleNamespace(type="thinking", text="Let me think..."),
+                SimpleNamespace(type="text", text="Here is the answer"),
+                SimpleNamespace(type="metadata", data={}),
+            ]
         )
 
+        result = ai_generator._extract_text_response(mock_response)
 
-if __name__ == "__main__":
-    pytest.main([__file__, "-v"])
+        # Should extract the text block
+        assert result == "Here is the answer"
+
+    def test_extract_text_response_no_text(self, ai_generator):
+        """Test extracting text when no text block exists"""
+        mock_response = SimpleNamespace(
+            content=[SimpleNamespace(type="metadata", data={})]
+        )
+
+        result = ai_generator._extract_text_response(mock_response)
+
+        # Should return fallback message
+        assert "couldn't generate a response" in result
@@ -4,11 +4,18 @@ Tests the REST API endpoints for proper request/response handling,
 error cases, and integration with the RAG system.
 """
 
-import pytest
+import asyncio
+import json
 from unittest.mock import Mock, patch
+
+import httpx
+import pytest
 from fastapi import HTTPException
 from fastapi.testclient import TestClient
 
+# Very long query (~6.5k characters), built once at import
+_LONG_QUERY = "What is MCP? " * 500
+
 
 @pytest.mark.api
 class TestAPIEndpoints:
@@ -46,7 +53,9 @@ class TestAPIEndpoints:
         assert data["session_id"] == "test_session_123"
 
         # Verify RAG system was called correctly
-        mock_rag_system.query.assert_called_once_with("What is MCP?", "test_session_123")
+        mock_rag_system.aquery.assert_awaited_once_with(
+            "What is MCP?", "test_session_123"
+        )
 
     def test_query_endpoint_with_existing_session(self, client, mock_rag_system):
         """Test query with an existing session ID"""
@@ -61,7 +70,7 @@ class TestAPIEndpoints:
         data = response.json()
 
         # Should use the provided session ID
-        mock_rag_system.query.assert_called_once_with(
+        mock_rag_system.aquery.assert_awaited_once_with(
             "Tell me more about MCP",
             "existing_session_456"
         )
@@ -103,7 +112,7 @@ class TestAPIEndpoints:
     def test_query_endpoint_internal_error(self, client, mock_rag_system):
         """Test /api/query handling of internal errors"""
         # Make RAG system raise an exception
-        mock_rag_system.query.side_effect = Exception("Internal processing error")
+        mock_rag_system.aquery.side_effect = Exception("Internal processing error")
 
         request_data = {
             "query": "What is MCP?",
@@ -115,6 +124,47 @@ class TestAPIEndpoints:
         assert response.status_code == 500
         assert "Internal processing error" in response.json()["detail"]
 
+    def test_query_stream_endpoint_success(self, client, mock_rag_system):
+        """Test /api/query/stream sends text events then sources with the session"""
+        response = client.post("/api/query/stream", json={"query": "What is MCP?"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+
+        events = [
+            json.loads(line[len("data: "):])
+            for line in response.text.splitlines()
+            if line.startswith("data: ")
+        ]
+        assert events == [
+            {"type": "text", "text": "This is a test answer about MCP."},
+            {
+                "type": "sources",
+                "sources": [
+                    {
+                        "text": "Introduction to MCP - Lesson 1",
+                        "link": "https://example.com/lesson1",
+                    }
+                ],
+                "session_id": "test_session_123",
+            },
+        ]
+
+        mock_rag_system.query_stream.assert_called_once_with(
+            "What is MCP?", "test_session_123"
+        )
+
+    def test_query_stream_endpoint_error_event(self, client, mock_rag_system):
+        """Test /api/query/stream reports errors as an event instead of a 500"""
+        mock_rag_system.query_stream.side_effect = Exception("Stream failed")
+
+        response = client.post("/api/query/stream", json={"query": "What is MCP?"})
+
+        assert response.status_code == 200
+        assert response.text == (
+            'data: {"type": "error", "detail": "Stream failed"}\n\n'
+        )
+
     def test_courses_endpoint_success(self, client, mock_rag_system):
         """Test successful request to /api/courses endpoint"""
         response = client.get("/api/courses")
@@ -213,14 +263,12 @@ class TestAPIEndpoints:
 
         assert response.status_code == 200
         # Query should be passed as-is to RAG system
-        mock_rag_system.query.assert_called_once()
+        mock_rag_system.aquery.assert_awaited_once()
 
     def test_query_with_very_long_text(self, client, mock_rag_system):
         """Test query with very long text input"""
-        long_query = "What is MCP? " * 500  # Very long query
-
         request_data = {
-            "query": long_query,
+            "query": _LONG_QUERY,
             "session_id": None
         }
 
@@ -229,18 +277,29 @@ class TestAPIEndpoints:
         # Should still process (no length limit in API)
         assert response.status_code == 200
 
-    def test_multiple_concurrent_queries(self, client, mock_rag_system):
-        """Test handling multiple queries in sequence"""
+    def test_multiple_concurrent_queries(self, test_app, mock_rag_system):
+        """Test handling multiple queries dispatched concurrently"""
         queries = [
             "What is MCP?",
             "Tell me about Python",
             "How does RAG work?"
         ]
 
-        for query in queries:
-            request_data = {"query": query, "session_id": None}
-            response = client.post("/api/query", json=request_data)
-            assert response.status_code == 200
+        async def post_all():
+            transport = httpx.ASGITransport(app=test_app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as ac:
+                return await asyncio.gather(*(
+                    ac.post("/api/query", json={"query": query, "session_id": None})
+                    for query in queries
+                ))
+
+        responses = asyncio.run(post_all())
+
+        assert [response.status_code for response in responses] == [200, 200, 200]
+        received = {call.args[0] for call in mock_rag_system.aquery.call_args_list}
+        assert received == set(queries)
 
     def test_session_persistence_across_queries(self, client, mock_rag_system):
         """Test that session ID persists across multiple queries"""
@@ -260,7 +319,7 @@ class TestAPIEndpoints:
         assert response2.json()["session_id"] == session_id
 
         # Verify RAG system received the same session ID
-        calls = mock_rag_system.query.call_args_list
+        calls = mock_rag_system.aquery.call_args_list
         assert calls[1][0][1] == session_id
 
 
@@ -279,60 +338,39 @@ class TestAPIErrorHandling:
         response = client.get("/api/query")
         assert response.status_code == 405
 
-    def test_query_with_null_values(self, client):
-        """Test query with null session_id (should be handled)"""
-        request_data = {
-            "query": "Valid query",
-            "session_id": None
-        }
-
-        response = client.post("/api/query", json=request_data)
-        assert response.status_code == 200
-
-    def test_query_with_additional_fields(self, client):
-        """Test that additional fields in request are ignored"""
-        request_data = {
-            "query": "Test query",
-            "session_id": None,
-            "extra_field": "should be ignored"
-        }
-
-        response = client.post("/api/query", json=request_data)
-        assert response.status_code == 200
-
-    def test_malformed_session_id(self, client, mock_rag_system):
-        """Test query with malformed session ID"""
-        request_data = {
-            "query": "Test",
-            "session_id": "invalid@#$%^&*()"
-        }
-
-        response = client.post("/api/query", json=request_data)
-        # Should still work - RAG system handles session validation
+    @pytest.mark.parametrize("payload", [
+        # Null session_id should be handled
+        {"query": "Valid query", "session_id": None},
+        # Additional fields in the request are ignored
+        {"query": "Test query", "session_id": None, "extra_field": "should be ignored"},
+        # Malformed session ID still works - RAG system handles session validation
+        {"query": "Test", "session_id": "invalid@#$%^&*()"},
+    ], ids=["null_values", "additional_fields", "malformed_session_id"])
+    def test_accepts_payload(self, client, payload):
+        """Test that unusual but valid query payloads are accepted"""
+        response = client.post("/api/query", json=payload)
         assert response.status_code == 200
 
 
 @pytest.mark.api
+@pytest.mark.slow
 class TestAPIIntegrationFlow:
     """Integration tests for complete API workflows"""
 
     def test_full_query_workflow(self, client, mock_rag_system):
         """Test complete query workflow from request to response"""
-        # Step 1: Get course list
-        courses_response = client.get("/api/courses")
-        assert courses_response.status_code == 200
-        courses = courses_response.json()
-        assert courses["total_courses"] > 0
-
-        # Step 2: Query about a course
+        # Step 1: Query about a course (the course list itself is covered by
+        # test_courses_endpoint_success)
+        analytics = mock_rag_system.get_course_analytics.return_value
+        course_title = analytics["course_titles"][0]
         query_response = client.post("/api/query", json={
-            "query": f"Tell me about {courses['course_titles'][0]}",
+            "query": f"Tell me about {course_title}",
             "session_id": None
         })
         assert query_response.status_code == 200
         query_data = query_response.json()
 
-        # Step 3: Follow-up query with same session
+        # Step 2: Follow-up query with same session
         followup_response = client.post("/api/query", json={
             "query": "Can you elaborate?",
             "session_id": query_data["session_id"]
@@ -353,7 +391,7 @@ class TestAPIIntegrationFlow:
     def test_error_recovery(self, client, mock_rag_system):
         """Test that API recovers from errors"""
         # First request fails
-        mock_rag_system.query.side_effect = Exception("Temporary error")
+        mock_rag_system.aquery.side_effect = Exception("Temporary error")
         response1 = client.post("/api/query", json={
             "query": "Test",
             "session_id": None
@@ -361,8 +399,8 @@ class TestAPIIntegrationFlow:
         assert response1.status_code == 500
 
         # Reset the mock to succeed
-        mock_rag_system.query.side_effect = None
-        mock_rag_system.query.return_value = (
+        mock_rag_system.aquery.side_effect = None
+        mock_rag_system.aquery.return_value = (
             "Success",
             [{"text": "Source", "link": "http://example.com"}]
         )
@@ -373,7 +411,3 @@ class TestAPIIntegrationFlow:
             "session_id": None
         })
         assert response2.status_code == 200
-
-
-if __name__ == "__main__":
-    pytest.main([__file__, "-v", "-m", "api"])
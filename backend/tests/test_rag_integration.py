@@ -1,39 +1,41 @@
 """Integration tests for RAG system query handling"""
 
-import os
-import sys
-from unittest.mock import MagicMock, Mock, patch
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import DEFAULT, AsyncMock, MagicMock, Mock, patch
 
 import pytest
 
-# Add backend to path for imports
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-
-from config import Config
+from ai_generator import AIGenerator
 from models import Course, CourseChunk, Lesson
 from rag_system import RAGSystem
-from vector_store import SearchResults
+from search_tools import ToolManager
 
 
 class TestRAGIntegration:
     """Integration tests for the full RAG query flow"""
 
-    @pytest.fixture
+    @pytest.fixture(scope="class")
     def mock_config(self):
         """Create test config"""
-        config = Mock(spec=Config)
-        config.CHUNK_SIZE = 800
-        config.CHUNK_OVERLAP = 100
-        config.CHROMA_PATH = "./test_chroma_db"
-        config.EMBEDDING_MODEL = "all-MiniLM-L6-v2"
-        config.MAX_RESULTS = 5
-        config.ANTHROPIC_API_KEY = "test_key"
-        config.ANTHROPIC_MODEL = "claude-sonnet-4-20250514"
-        config.MAX_HISTORY = 2
-        config.MAX_TOOL_ROUNDS = 2
-        return config
+        return SimpleNamespace(
+            CHUNK_SIZE=800,
+            CHUNK_OVERLAP=100,
+            CHROMA_PATH="./test_chroma_db",
+            EMBEDDING_MODEL="all-MiniLM-L6-v2",
+            MAX_RESULTS=5,
+            ANTHROPIC_API_KEY="test_key",
+            ANTHROPIC_MODEL="claude-sonnet-4-20250514",
+            MAX_HISTORY=2,
+            MAX_API_CALLS=3,
+            MAX_API_RETRIES=3,
+            MAX_INPUT_TOKENS=150_000,
+            MAX_OUTPUT_TOKENS=800,
+            RESPONSE_CACHE_SIZE=16,
+            RESPONSE_CACHE_TTL=60,
+        )
 
-    @pytest.fixture
+    @pytest.fixture(scope="class")
     def mock_vector_store(self):
         """Create mock vector store"""
         with patch("rag_system.VectorStore") as MockVectorStore:
@@ -41,25 +43,55 @@ class TestRAGIntegration:
             MockVectorStore.return_value = mock_store
             yield mock_store
 
-    @pytest.fixture
+    @pytest.fixture(scope="class")
     def mock_ai_generator(self):
         """Create mock AI generator"""
         with patch("rag_system.AIGenerator") as MockAIGenerator:
-            mock_gen = Mock()
+            mock_gen = Mock(FALLBACK_RESPONSE=AIGenerator.FALLBACK_RESPONSE)
             MockAIGenerator.return_value = mock_gen
             yield mock_gen
 
-    @pytest.fixture
+    @pytest.fixture(scope="class")
     def rag_system(self, mock_config, mock_vector_store, mock_ai_generator):
         """Create RAG system with mocked dependencies"""
-        with patch("rag_system.DocumentProcessor"):
-            with patch("rag_system.SessionManager"):
-                system = RAGSystem(mock_config)
-                system.vector_store = mock_vector_store
-                system.ai_generator = mock_ai_generator
-                return system
-
-    def test_query_with_course_content_question(self, rag_system, mock_ai_generator):
+        with patch.multiple(
+            "rag_system", DocumentProcessor=DEFAULT, SessionManager=DEFAULT
+        ):
+            system = RAGSystem(mock_config)
+            system.vector_store = mock_vector_store
+            system.ai_generator = mock_ai_generator
+            return system
+
+    @pytest.fixture(scope="class")
+    def mcp_search_results(self, make_results):
+        """Search results for a single MCP lesson chunk, shared by the class"""
+        return make_results(
+            ["MCP is a protocol for context"], "Intro to MCP", 1, distance=0.3
+        )
+
+    @pytest.fixture(autouse=True)
+    def reset_shared_state(self, rag_system, mock_vector_store, mock_ai_generator):
+        """Clear mock configuration, sources and cached responses between tests"""
+        yield
+        mock_ai_generator.reset_mock(return_value=True, side_effect=True)
+        mock_vector_store.reset_mock(return_value=True, side_effect=True)
+        rag_system.tool_manager.reset_sources()
+        rag_system.response_cache.clear()
+
+    @pytest.fixture
+    def request_tools(self, rag_system, monkeypatch):
+        """Stub the per-request tool manager handed to the AI generator"""
+        manager = Mock(spec=ToolManager)
+        manager.get_last_sources.return_value = []
+        manager.tool_failed = False
+        monkeypatch.setattr(
+            rag_system.tool_manager, "for_request", Mock(return_value=manager)
+        )
+        return manager
+
+    def test_query_with_course_content_question(
+        self, rag_system, mock_ai_generator, request_tools
+    ):
         """Test querying course content (should trigger tool use)"""
         # Mock AI response
         mock_ai_generator.generate_response.return_value = (
@@ -67,14 +99,12 @@ class TestRAGIntegration:
         )
 
         # Mock sources from tool
-        rag_system.tool_manager.get_last_sources = Mock(
-            return_value=[
-                {
-                    "text": "Introduction to MCP - Lesson 1",
-                    "link": "https://example.com/lesson1",
-                }
-            ]
-        )
+        request_tools.get_last_sources.return_value = [
+            {
+                "text": "Introduction to MCP - Lesson 1",
+                "link": "https://example.com/lesson1",
+            }
+        ]
 
         answer, sources = rag_system.query("What is MCP?")
 
@@ -87,7 +117,7 @@ class TestRAGIntegration:
 
         # Should have tools available
         assert call_args.kwargs["tools"] is not None
-        assert call_args.kwargs["tool_manager"] is not None
+        assert call_args.kwargs["tool_manager"] is request_tools
 
         # Verify response
         assert answer == "MCP stands for Model Context Protocol"
@@ -101,9 +131,6 @@ class TestRAGIntegration:
             "Python is a programming language"
         )
 
-        # No sources from tool
-        rag_system.tool_manager.get_last_sources = Mock(return_value=[])
-
         answer, sources = rag_system.query("What is Python?")
 
         # Should still call AI with tools available (Claude decides not to use them)
@@ -113,19 +140,20 @@ class TestRAGIntegration:
         assert answer == "Python is a programming language"
         assert len(sources) == 0
 
-    def test_query_with_session_id(self, rag_system, mock_ai_generator):
+    def test_query_with_session_id(self, rag_system, mock_ai_generator, monkeypatch):
         """Test query with session for conversation context"""
         session_id = "test_session_123"
 
         # Mock session manager
         mock_history = "User: Previous question\nAssistant: Previous answer"
-        rag_system.session_manager.get_conversation_history = Mock(
-            return_value=mock_history
+        monkeypatch.setattr(
+            rag_system.session_manager,
+            "get_conversation_history",
+            Mock(return_value=mock_history),
         )
-        rag_system.session_manager.add_exchange = Mock()
+        monkeypatch.setattr(rag_system.session_manager, "add_exchange", Mock())
 
         mock_ai_generator.generate_response.return_value = "Follow-up answer"
-        rag_system.tool_manager.get_last_sources = Mock(return_value=[])
 
         answer, sources = rag_system.query("Follow up question", session_id=session_id)
 
@@ -146,7 +174,6 @@ class TestRAGIntegration:
     def test_query_without_session_id(self, rag_system, mock_ai_generator):
         """Test query without session (no history)"""
         mock_ai_generator.generate_response.return_value = "Answer"
-        rag_system.tool_manager.get_last_sources = Mock(return_value=[])
 
         answer, sources = rag_system.query("Question")
 
@@ -157,7 +184,6 @@ class TestRAGIntegration:
     def test_query_tool_flow(self, rag_system, mock_ai_generator, mock_vector_store):
         """Test that query sets up tools correctly"""
         mock_ai_generator.generate_response.return_value = "Answer"
-        rag_system.tool_manager.get_last_sources = Mock(return_value=[])
 
         answer, sources = rag_system.query("Test query")
 
@@ -171,35 +197,167 @@ class TestRAGIntegration:
         assert "search_course_content" in tool_names
         assert "get_course_outline" in tool_names
 
-    def test_query_sources_reset_after_retrieval(self, rag_system, mock_ai_generator):
-        """Test that sources are reset after being retrieved"""
+    def test_query_sources_come_from_request_manager(
+        self, rag_system, mock_ai_generator, request_tools
+    ):
+        """Test that sources are read from the query's own tool manager"""
         mock_ai_generator.generate_response.return_value = "Answer"
 
         # Mock sources
         mock_sources = [{"text": "Source 1", "link": "link1"}]
-        rag_system.tool_manager.get_last_sources = Mock(return_value=mock_sources)
-        rag_system.tool_manager.reset_sources = Mock()
+        request_tools.get_last_sources.return_value = mock_sources
 
         answer, sources = rag_system.query("Test")
 
-        # Verify sources were retrieved
-        rag_system.tool_manager.get_last_sources.assert_called_once()
+        # Verify sources were retrieved from the per-request manager
+        request_tools.get_last_sources.assert_called_once()
+        assert sources == mock_sources
+
+        # The shared search tool never saw them
+        assert rag_system.search_tool.last_sources == []
+
+    def test_concurrent_aqueries_keep_their_own_sources(
+        self, rag_system, mock_ai_generator, mock_vector_store, make_results
+    ):
+        """Test that overlapping async queries don't swap each other's sources"""
+        mock_vector_store.search.side_effect = lambda query, **kwargs: make_results(
+            [f"About {query}"], f"{query} course", 1
+        )
+        mock_vector_store.get_lesson_link.return_value = None
+
+        async def agenerate_response(**kwargs):
+            topic = kwargs["query"].rsplit(" ", 1)[-1]
+            kwargs["tool_manager"].execute_tool("search_course_content", query=topic)
+            # Let the other query search before this one collects its sources
+            await asyncio.sleep(0.01)
+            return f"Answer about {topic}"
+
+        mock_ai_generator.agenerate_response = AsyncMock(side_effect=agenerate_response)
+
+        async def run_both():
+            return await asyncio.gather(
+                rag_system.aquery("MCP"), rag_system.aquery("RAG")
+            )
+
+        mcp, rag = asyncio.run(run_both())
+
+        assert mcp == (
+            "Answer about MCP",
+            [{"text": "MCP course - Lesson 1", "link": None}],
+        )
+        assert rag == (
+            "Answer about RAG",
+            [{"text": "RAG course - Lesson 1", "link": None}],
+        )
+
+    def test_repeated_query_served_from_cache(
+        self, rag_system, mock_ai_generator, request_tools
+    ):
+        """Test that an identical query reuses the cached response and sources"""
+        mock_ai_generator.generate_response.return_value = "Cached answer"
+        mock_sources = [{"text": "Source 1", "link": "link1"}]
+        request_tools.get_last_sources.return_value = mock_sources
+
+        first = rag_system.query("What is MCP?")
+        second = rag_system.query("What is MCP?")
+
+        assert first == second == ("Cached answer", mock_sources)
+        assert mock_ai_generator.generate_response.call_count == 1
+
+        # A different query misses the cache
+        rag_system.query("What is RAG?")
+        assert mock_ai_generator.generate_response.call_count == 2
+
+    def test_fallback_answer_not_cached(self, rag_system, mock_ai_generator):
+        """Test the generator's fallback answer is returned but not cached"""
+        mock_ai_generator.generate_response.return_value = AIGenerator.FALLBACK_RESPONSE
 
-        # Verify sources were reset
-        rag_system.tool_manager.reset_sources.assert_called_once()
+        rag_system.query("What is MCP?")
+        answer, _ = rag_system.query("What is MCP?")
+
+        assert answer == AIGenerator.FALLBACK_RESPONSE
+        assert mock_ai_generator.generate_response.call_count == 2
+
+    def test_answer_after_tool_failure_not_cached(
+        self, rag_system, mock_ai_generator, mock_vector_store, mcp_search_results
+    ):
+        """Test an answer built after a tool raised is not cached"""
+        mock_vector_store.search.side_effect = RuntimeError("Database unavailable")
+
+        def generate_response(**kwargs):
+            try:
+                kwargs["tool_manager"].execute_tool(
+                    "search_course_content", query="MCP"
+                )
+            except RuntimeError:
+                return "Search is unavailable right now"
+            return "MCP is a protocol"
+
+        mock_ai_generator.generate_response.side_effect = generate_response
+
+        first, _ = rag_system.query("What is MCP?")
+
+        # Once the store recovers, the same query is answered afresh
+        mock_vector_store.search.side_effect = None
+        mock_vector_store.search.return_value = mcp_search_results
+        second, _ = rag_system.query("What is MCP?")
+
+        assert first == "Search is unavailable right now"
+        assert second == "MCP is a protocol"
+        assert mock_ai_generator.generate_response.call_count == 2
+
+    def test_aquery_awaits_async_generator(
+        self, rag_system, mock_ai_generator, request_tools
+    ):
+        """Test that the async query path awaits agenerate_response"""
+        mock_ai_generator.agenerate_response = AsyncMock(return_value="Async answer")
+
+        answer, sources = asyncio.run(rag_system.aquery("What is MCP?"))
+
+        assert answer == "Async answer"
+        assert sources == []
+        call_args = mock_ai_generator.agenerate_response.call_args
+        assert call_args.kwargs["tool_manager"] is request_tools
+
+    def test_query_stream_yields_text_then_sources(
+        self, rag_system, mock_ai_generator, request_tools
+    ):
+        """Test that streamed queries yield text chunks followed by sources"""
+
+        def generate_response_stream(**kwargs):
+            yield "Let me check."
+            yield "\n\n"
+            yield "MCP is "
+            yield "a protocol"
+            return "MCP is a protocol"
+
+        mock_ai_generator.generate_response_stream.side_effect = (
+            generate_response_stream
+        )
+        mock_sources = [{"text": "Source 1", "link": "link1"}]
+        request_tools.get_last_sources.return_value = mock_sources
+
+        events = list(rag_system.query_stream("What is MCP?"))
+
+        assert events == [
+            {"type": "text", "text": "Let me check."},
+            {"type": "text", "text": "\n\n"},
+            {"type": "text", "text": "MCP is "},
+            {"type": "text", "text": "a protocol"},
+            {"type": "sources", "sources": mock_sources},
+        ]
+
+        # Only the final answer is cached for the non-streaming path
+        answer, sources = rag_system.query("What is MCP?")
+        assert answer == "MCP is a protocol"
+        assert not mock_ai_generator.generate_response.called
 
     def test_search_tool_integration_with_vector_store(
-        self, rag_system, mock_vector_store
+        self, rag_system, mock_vector_store, mcp_search_results
     ):
         """Test that search tool correctly uses vector store"""
         # Setup mock vector store search results
-        mock_results = SearchResults(
-            documents=["Test content"],
-            metadata=[{"course_title": "Test Course", "lesson_number": 1}],
-            distances=[0.5],
-            error=None,
-        )
-        mock_vector_store.search.return_value = mock_results
+        mock_vector_store.search.return_value = mcp_search_results
         mock_vector_store.get_lesson_link.return_value = "https://example.com"
 
         # Execute search through tool manager
@@ -213,8 +371,8 @@ class TestRAGIntegration:
         )
 
         # Verify result is formatted
-        assert "Test Course" in result
-        assert "Test content" in result
+        assert "Intro to MCP" in result
+        assert "MCP is a protocol for context" in result
 
     def test_outline_tool_integration(self, rag_system, mock_vector_store):
         """Test that outline tool works correctly"""
@@ -242,65 +400,62 @@ class TestRAGIntegration:
         assert "Lesson 1: Intro" in result
 
     def test_query_handles_no_results(
-        self, rag_system, mock_ai_generator, mock_vector_store
+        self, rag_system, mock_ai_generator, mock_vector_store, empty_search_results
     ):
         """Test query handling when search returns no results"""
+        mock_vector_store.search.return_value = empty_search_results
+
         # Mock AI to use search tool that returns nothing
-        mock_ai_generator.generate_response.return_value = (
-            "I couldn't find information on that topic"
-        )
-        rag_system.tool_manager.get_last_sources = Mock(return_value=[])
+        def generate_response(**kwargs):
+            result = kwargs["tool_manager"].execute_tool(
+                "search_course_content", query="nonexistent topic"
+            )
+            assert "No relevant content found" in result
+            return "I couldn't find information on that topic"
+
+        mock_ai_generator.generate_response.side_effect = generate_response
 
         answer, sources = rag_system.query("nonexistent topic")
 
         assert "couldn't find" in answer.lower()
         assert len(sources) == 0
 
-    def test_full_query_flow_simulation(self, mock_config):
+    def test_full_query_flow_simulation(self, mock_config, mcp_search_results):
         """Test a simulated full query flow with real tool interactions"""
         # This test uses real tool classes but mocks external dependencies
-        with patch("rag_system.VectorStore") as MockVectorStore:
-            with patch("rag_system.AIGenerator") as MockAIGenerator:
-                with patch("rag_system.DocumentProcessor"):
-                    with patch("rag_system.SessionManager"):
-                        # Setup mocks
-                        mock_store = Mock()
-                        MockVectorStore.return_value = mock_store
-
-                        mock_ai = Mock()
-                        MockAIGenerator.return_value = mock_ai
-
-                        # Create RAG system
-                        rag = RAGSystem(mock_config)
-
-                        # Simulate vector store search
-                        mock_results = SearchResults(
-                            documents=["MCP is a protocol for context"],
-                            metadata=[
-                                {"course_title": "Intro to MCP", "lesson_number": 1}
-                            ],
-                            distances=[0.3],
-                            error=None,
-                        )
-                        mock_store.search.return_value = mock_results
-                        mock_store.get_lesson_link.return_value = (
-                            "https://example.com/lesson1"
-                        )
-
-                        # Simulate AI response
-                        mock_ai.generate_response.return_value = "MCP (Model Context Protocol) is a protocol for managing context"
-
-                        # Execute query
-                        answer, sources = rag.query("What is MCP?")
-
-                        # Verify the flow
-                        assert mock_ai.generate_response.called
-                        assert "MCP" in answer
-
-                        # Sources should be populated from search results
-                        # Note: sources come from tool execution during AI generation
-                        # In real flow, AI would call the tool, which would populate last_sources
-
-
-if __name__ == "__main__":
-    pytest.main([__file__, "-v"])
+        with patch.multiple(
+            "rag_system",
+            VectorStore=DEFAULT,
+            AIGenerator=DEFAULT,
+            DocumentProcessor=DEFAULT,
+            SessionManager=DEFAULT,
+        ) as patched:
+            # Setup mocks
+            mock_store = Mock()
+            patched["VectorStore"].return_value = mock_store
+
+            mock_ai = Mock()
+            patched["AIGenerator"].return_value = mock_ai
+
+            # Create RAG system
+            rag = RAGSystem(mock_config)
+
+            # Simulate vector store search
+            mock_store.search.return_value = mcp_search_results
+            mock_store.get_lesson_link.return_value = "https://example.com/lesson1"
+
+            # Simulate AI response
+            mock_ai.generate_response.return_value = (
+                "MCP (Model Context Protocol) is a protocol for managing context"
+            )
+
+            # Execute query
+            answer, sources = rag.query("What is MCP?")
+
+            # Verify the flow
+            assert mock_ai.generate_response.called
+            assert "MCP" in answer
+
+            # Sources should be populated from search results
+            # Note: sources come from tool execution during AI generation
+            # In real flow, AI would call the tool, which would populate last_sources
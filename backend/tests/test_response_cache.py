@@ -0,0 +1,56 @@
+"""Tests for the in-process ResponseCache"""
+
+from unittest.mock import patch
+
+from response_cache import ResponseCache
+
+
+class TestResponseCache:
+    """Test suite for ResponseCache"""
+
+    def test_make_key_is_order_independent(self):
+        """Test that keys depend on content, not keyword order"""
+        key1 = ResponseCache.make_key(query="q", history=None, tools=["a"])
+        key2 = ResponseCache.make_key(tools=["a"], query="q", history=None)
+
+        assert key1 == key2
+        assert key1 != ResponseCache.make_key(query="q", history="h", tools=["a"])
+
+    def test_get_and_set(self):
+        """Test storing and retrieving a value"""
+        cache = ResponseCache(max_size=2, ttl=60)
+
+        assert cache.get("missing") is None
+
+        cache.set("key", ("answer", []))
+        assert cache.get("key") == ("answer", [])
+
+    def test_expired_entries_are_dropped(self):
+        """Test that entries expire after their TTL"""
+        cache = ResponseCache(max_size=2, ttl=10)
+
+        with patch("response_cache.time.monotonic", return_value=100.0):
+            cache.set("key", "answer")
+        with patch("response_cache.time.monotonic", return_value=111.0):
+            assert cache.get("key") is None
+
+        assert len(cache) == 0
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """Test LRU eviction once max_size is exceeded"""
+        cache = ResponseCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_zero_size_disables_cache(self):
+        """Test that max_size=0 stores nothing"""
+        cache = ResponseCache(max_size=0)
+        cache.set("key", "answer")
+
+        assert cache.get("key") is None
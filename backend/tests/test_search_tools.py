@@ -1,18 +1,54 @@
 """Tests for CourseSearchTool.execute() method"""
 
-import os
-import sys
+from types import SimpleNamespace
 from unittest.mock import MagicMock, Mock
 
 import pytest
-
-# Add backend to path for imports
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from jsonschema import Draft7Validator
 
 from models import Course, Lesson
 from search_tools import CourseSearchTool, ToolManager
 from vector_store import SearchResults, VectorStore
 
+# Tool definitions shared by the ToolManager tests; never mutated
+_MOCK_TOOL_DEF = {"name": "mock_tool", "description": "A mock tool"}
+_SEARCH_TOOL_DEF = {"name": "search", "description": "Search"}
+
+# Expected shape of the search tool's Anthropic definition
+_SEARCH_TOOL_DEF_VALIDATOR = Draft7Validator(
+    {
+        "type": "object",
+        "required": ["name", "description", "input_schema"],
+        "properties": {
+            "name": {"const": "search_course_content"},
+            "input_schema": {
+                "type": "object",
+                "required": ["properties", "required"],
+                "properties": {
+                    "required": {"const": ["query"]},
+                    "properties": {
+                        "required": ["query", "course_name", "lesson_number"]
+                    },
+                },
+            },
+        },
+    }
+)
+
+
+class _RecordingTool:
+    """Stub tool that records the keyword arguments of each execute call"""
+
+    def __init__(self):
+        self.calls = []
+
+    def get_tool_definition(self):
+        return _MOCK_TOOL_DEF
+
+    def execute(self, **kwargs):
+        self.calls.append(kwargs)
+        return "mock result"
+
 
 class TestCourseSearchTool:
     """Test suite for CourseSearchTool.execute() method"""
@@ -30,120 +66,138 @@ class TestCourseSearchTool:
 
     def test_tool_definition(self, search_tool):
         """Test that tool definition is correctly formatted"""
-        tool_def = search_tool.get_tool_definition()
-
-        assert tool_def["name"] == "search_course_content"
-        assert "description" in tool_def
-        assert "input_schema" in tool_def
-        assert tool_def["input_schema"]["required"] == ["query"]
-        assert "query" in tool_def["input_schema"]["properties"]
-        assert "course_name" in tool_def["input_schema"]["properties"]
-        assert "lesson_number" in tool_def["input_schema"]["properties"]
-
-    def test_execute_successful_search(self, search_tool, mock_vector_store):
-        """Test execute with successful search results"""
-        # Mock successful search results
-        mock_results = SearchResults(
-            documents=["This is content about MCP"],
-            metadata=[{"course_title": "Introduction to MCP", "lesson_number": 1}],
-            distances=[0.5],
-            error=None,
-        )
-        mock_vector_store.search.return_value = mock_results
-        mock_vector_store.get_lesson_link.return_value = "https://example.com/lesson1"
-
-        # Execute search
-        result = search_tool.execute(query="What is MCP?")
-
-        # Verify search was called
+        _SEARCH_TOOL_DEF_VALIDATOR.validate(search_tool.get_tool_definition())
+
+    @pytest.mark.parametrize(
+        "search_kwargs,results,lesson_link,expected_substrings,expected_sources",
+        [
+            pytest.param(
+                {"query": "What is MCP?"},
+                SearchResults(
+                    documents=["This is content about MCP"],
+                    metadata=[
+                        {"course_title": "Introduction to MCP", "lesson_number": 1}
+                    ],
+                    distances=[0.5],
+                ),
+                "https://example.com/lesson1",
+                ["[Introduction to MCP - Lesson 1]", "This is content about MCP"],
+                [
+                    {
+                        "text": "Introduction to MCP - Lesson 1",
+                        "link": "https://example.com/lesson1",
+                    }
+                ],
+                id="no_filter",
+            ),
+            pytest.param(
+                {"query": "How to use FastAPI?", "course_name": "FastAPI"},
+                SearchResults(
+                    documents=["Content about fastapi"],
+                    metadata=[{"course_title": "FastAPI Course", "lesson_number": 2}],
+                    distances=[0.3],
+                ),
+                None,
+                ["FastAPI Course"],
+                [{"text": "FastAPI Course - Lesson 2", "link": None}],
+                id="course_filter",
+            ),
+            pytest.param(
+                {"query": "loops", "course_name": "Python", "lesson_number": 3},
+                SearchResults(
+                    documents=["Lesson 3 content"],
+                    metadata=[{"course_title": "Python Basics", "lesson_number": 3}],
+                    distances=[0.2],
+                ),
+                "https://example.com/lesson3",
+                ["Python Basics", "Lesson 3"],
+                [
+                    {
+                        "text": "Python Basics - Lesson 3",
+                        "link": "https://example.com/lesson3",
+                    }
+                ],
+                id="lesson_filter",
+            ),
+            pytest.param(
+                {"query": "test"},
+                SearchResults(
+                    documents=["Content 1", "Content 2", "Content 3"],
+                    metadata=[
+                        {"course_title": "Course A", "lesson_number": 1},
+                        {"course_title": "Course B", "lesson_number": 2},
+                        {"course_title": "Course A", "lesson_number": 3},
+                    ],
+                    distances=[0.1, 0.2, 0.3],
+                ),
+                "https://example.com",
+                ["Content 1", "Content 2", "Content 3"],
+                [
+                    {"text": "Course A - Lesson 1", "link": "https://example.com"},
+                    {"text": "Course B - Lesson 2", "link": "https://example.com"},
+                    {"text": "Course A - Lesson 3", "link": "https://example.com"},
+                ],
+                id="multiple_results",
+            ),
+        ],
+    )
+    def test_execute_formats_results(
+        self,
+        search_tool,
+        mock_vector_store,
+        search_kwargs,
+        results,
+        lesson_link,
+        expected_substrings,
+        expected_sources,
+    ):
+        """Test execute passes filters through and formats results and sources"""
+        mock_vector_store.search.return_value = results
+        mock_vector_store.get_lesson_link.return_value = lesson_link
+
+        result = search_tool.execute(**search_kwargs)
+
+        # Verify search was called with the requested filters
         mock_vector_store.search.assert_called_once_with(
-            query="What is MCP?", course_name=None, lesson_number=None
+            query=search_kwargs["query"],
+            course_name=search_kwargs.get("course_name"),
+            lesson_number=search_kwargs.get("lesson_number"),
         )
 
         # Verify result is formatted correctly
-        assert "[Introduction to MCP - Lesson 1]" in result
-        assert "This is content about MCP" in result
+        for expected in expected_substrings:
+            assert expected in result
 
         # Verify sources are tracked
-        assert len(search_tool.last_sources) == 1
-        assert search_tool.last_sources[0]["text"] == "Introduction to MCP - Lesson 1"
-        assert search_tool.last_sources[0]["link"] == "https://example.com/lesson1"
-
-    def test_execute_with_course_filter(self, search_tool, mock_vector_store):
-        """Test execute with course_name parameter"""
-        mock_results = SearchResults(
-            documents=["Content about fastapi"],
-            metadata=[{"course_title": "FastAPI Course", "lesson_number": 2}],
-            distances=[0.3],
-            error=None,
-        )
-        mock_vector_store.search.return_value = mock_results
-        mock_vector_store.get_lesson_link.return_value = None
-
-        result = search_tool.execute(query="How to use FastAPI?", course_name="FastAPI")
-
-        # Verify search was called with course_name
-        mock_vector_store.search.assert_called_once_with(
-            query="How to use FastAPI?", course_name="FastAPI", lesson_number=None
-        )
-
-        assert "FastAPI Course" in result
-
-    def test_execute_with_lesson_filter(self, search_tool, mock_vector_store):
-        """Test execute with lesson_number parameter"""
-        mock_results = SearchResults(
-            documents=["Lesson 3 content"],
-            metadata=[{"course_title": "Python Basics", "lesson_number": 3}],
-            distances=[0.2],
-            error=None,
-        )
-        mock_vector_store.search.return_value = mock_results
-        mock_vector_store.get_lesson_link.return_value = "https://example.com/lesson3"
-
-        result = search_tool.execute(
-            query="loops", course_name="Python", lesson_number=3
-        )
-
-        # Verify search was called with both filters
-        mock_vector_store.search.assert_called_once_with(
-            query="loops", course_name="Python", lesson_number=3
-        )
-
-        assert "Python Basics" in result
-        assert "Lesson 3" in result
+        assert search_tool.last_sources == expected_sources
 
-    def test_execute_with_error(self, search_tool, mock_vector_store):
+    def test_execute_with_error(self, search_tool, mock_vector_store, make_results):
         """Test execute when vector store returns an error"""
-        mock_results = SearchResults(
-            documents=[],
-            metadata=[],
-            distances=[],
-            error="No course found matching 'NonExistent'",
-        )
-        mock_vector_store.search.return_value = mock_results
+        mock_results = make_results([], error="No course found matching 'NonExistent'")
+        mock_vector_store.search = lambda **kwargs: mock_results
 
         result = search_tool.execute(query="test", course_name="NonExistent")
 
         # Should return the error message
         assert result == "No course found matching 'NonExistent'"
 
-    def test_execute_with_empty_results(self, search_tool, mock_vector_store):
+    def test_execute_with_empty_results(
+        self, search_tool, mock_vector_store, make_results
+    ):
         """Test execute when no results are found"""
-        mock_results = SearchResults(
-            documents=[], metadata=[], distances=[], error=None
-        )
-        mock_vector_store.search.return_value = mock_results
+        mock_results = make_results([])
+        mock_vector_store.search = lambda **kwargs: mock_results
 
         result = search_tool.execute(query="nonexistent topic")
 
         assert "No relevant content found" in result
 
-    def test_execute_empty_results_with_filters(self, search_tool, mock_vector_store):
+    def test_execute_empty_results_with_filters(
+        self, search_tool, mock_vector_store, make_results
+    ):
         """Test execute with empty results and filter info"""
-        mock_results = SearchResults(
-            documents=[], metadata=[], distances=[], error=None
-        )
-        mock_vector_store.search.return_value = mock_results
+        mock_results = make_results([])
+        mock_vector_store.search = lambda **kwargs: mock_results
 
         result = search_tool.execute(query="test", course_name="MCP", lesson_number=5)
 
@@ -151,16 +205,13 @@ class TestCourseSearchTool:
         assert "course 'MCP'" in result
         assert "lesson 5" in result
 
-    def test_format_results_without_lesson_number(self, search_tool, mock_vector_store):
+    def test_format_results_without_lesson_number(
+        self, search_tool, mock_vector_store, make_results
+    ):
         """Test formatting when metadata doesn't have lesson_number"""
-        mock_results = SearchResults(
-            documents=["General course info"],
-            metadata=[{"course_title": "Test Course"}],
-            distances=[0.1],
-            error=None,
-        )
-        mock_vector_store.search.return_value = mock_results
-        mock_vector_store.get_lesson_link.return_value = None
+        mock_results = make_results(["General course info"], "Test Course")
+        mock_vector_store.search = lambda **kwargs: mock_results
+        mock_vector_store.get_lesson_link = lambda course_title, lesson_number: None
 
         result = search_tool.execute(query="info")
 
@@ -172,50 +223,27 @@ class TestCourseSearchTool:
         assert search_tool.last_sources[0]["text"] == "Test Course"
         assert search_tool.last_sources[0]["link"] is None
 
-    def test_multiple_results(self, search_tool, mock_vector_store):
-        """Test formatting with multiple search results"""
-        mock_results = SearchResults(
-            documents=["Content 1", "Content 2", "Content 3"],
-            metadata=[
-                {"course_title": "Course A", "lesson_number": 1},
-                {"course_title": "Course B", "lesson_number": 2},
-                {"course_title": "Course A", "lesson_number": 3},
-            ],
-            distances=[0.1, 0.2, 0.3],
-            error=None,
-        )
-        mock_vector_store.search.return_value = mock_results
-        mock_vector_store.get_lesson_link.return_value = "https://example.com"
-
-        result = search_tool.execute(query="test")
-
-        # Should have all three results
-        assert "Content 1" in result
-        assert "Content 2" in result
-        assert "Content 3" in result
-
-        # Should have three sources
-        assert len(search_tool.last_sources) == 3
-
 
 class TestToolManager:
     """Test suite for ToolManager"""
 
-    @pytest.fixture
+    @pytest.fixture(scope="class")
     def tool_manager(self):
-        """Create ToolManager instance"""
+        """Create ToolManager instance shared by the class"""
         return ToolManager()
 
-    @pytest.fixture
+    @pytest.fixture(scope="class")
     def mock_tool(self):
-        """Create a mock tool"""
-        tool = Mock()
-        tool.get_tool_definition.return_value = {
-            "name": "mock_tool",
-            "description": "A mock tool",
-        }
-        tool.execute.return_value = "mock result"
-        return tool
+        """Create a stub tool that records its calls"""
+        return _RecordingTool()
+
+    @pytest.fixture(autouse=True)
+    def reset_registry(self, tool_manager, mock_tool):
+        """Start each test with an empty registry and no recorded tool calls"""
+        yield
+        mock_tool.calls.clear()
+        tool_manager.tools.clear()
+        tool_manager.tool_failed = False
 
     def test_register_tool(self, tool_manager, mock_tool):
         """Test registering a tool"""
@@ -239,7 +267,7 @@ class TestToolManager:
 
         result = tool_manager.execute_tool("mock_tool", param="value")
 
-        mock_tool.execute.assert_called_once_with(param="value")
+        assert mock_tool.calls == [{"param": "value"}]
         assert result == "mock result"
 
     def test_execute_nonexistent_tool(self, tool_manager):
@@ -250,12 +278,10 @@ class TestToolManager:
 
     def test_get_last_sources(self, tool_manager):
         """Test getting sources from search tool"""
-        mock_search_tool = Mock()
-        mock_search_tool.get_tool_definition.return_value = {
-            "name": "search",
-            "description": "Search",
-        }
-        mock_search_tool.last_sources = [{"text": "Source 1", "link": "link1"}]
+        mock_search_tool = SimpleNamespace(
+            get_tool_definition=lambda: _SEARCH_TOOL_DEF,
+            last_sources=[{"text": "Source 1", "link": "link1"}],
+        )
 
         tool_manager.register_tool(mock_search_tool)
 
@@ -265,18 +291,50 @@ class TestToolManager:
 
     def test_reset_sources(self, tool_manager):
         """Test resetting sources"""
-        mock_search_tool = Mock()
-        mock_search_tool.get_tool_definition.return_value = {
-            "name": "search",
-            "description": "Search",
-        }
-        mock_search_tool.last_sources = [{"text": "Source 1", "link": "link1"}]
+        mock_search_tool = SimpleNamespace(
+            get_tool_definition=lambda: _SEARCH_TOOL_DEF,
+            last_sources=[{"text": "Source 1", "link": "link1"}],
+        )
 
         tool_manager.register_tool(mock_search_tool)
         tool_manager.reset_sources()
 
         assert mock_search_tool.last_sources == []
 
+    def test_failed_tool_marks_manager(self, tool_manager):
+        """Test a raising tool flags its request manager, and the flag merges back"""
+        failing_tool = SimpleNamespace(
+            get_tool_definition=lambda: _MOCK_TOOL_DEF,
+            execute=Mock(side_effect=RuntimeError("Database unavailable")),
+        )
+        tool_manager.register_tool(failing_tool)
+        request_manager = tool_manager.for_request()
+
+        with pytest.raises(RuntimeError):
+            request_manager.execute_tool("mock_tool")
+
+        assert request_manager.tool_failed
+        assert not tool_manager.tool_failed
+        tool_manager.adopt_sources(request_manager)
+        assert tool_manager.tool_failed
+
+    def test_for_request_tracks_sources_separately(self, tool_manager):
+        """Test that a per-request manager keeps its sources to itself"""
+        mock_search_tool = SimpleNamespace(
+            get_tool_definition=lambda: _SEARCH_TOOL_DEF,
+            last_sources=[{"text": "Source 1", "link": "link1"}],
+        )
+        tool_manager.register_tool(mock_search_tool)
+
+        request_manager = tool_manager.for_request()
+        assert request_manager.get_last_sources() == []
+
+        request_manager.tools["search"].last_sources = [
+            {"text": "Source 2", "link": "link2"}
+        ]
+        assert mock_search_tool.last_sources == [{"text": "Source 1", "link": "link1"}]
 
-if __name__ == "__main__":
-    pytest.main([__file__, "-v"])
+        tool_manager.adopt_sources(request_manager)
+        assert tool_manager.get_last_sources() == [
+            {"text": "Source 2", "link": "link2"}
+        ]
@@ -3,9 +3,10 @@ from typing import Any, Dict, List, Optional
 
 import chromadb
 from chromadb.config import Settings
-from models import Course, CourseChunk
 from sentence_transformers import SentenceTransformer
 
+from models import Course, CourseChunk
+
 
 @dataclass
 class SearchResults: